@@ -6,9 +6,9 @@ import logging
 
 import attr
 import redo
-import yaml
 from requests.exceptions import ChunkedEncodingError, ConnectionError, SSLError
 
+from .util import yml
 from .util.http import SESSION
 
 logger = logging.getLogger(__name__)
@@ -70,7 +70,7 @@ class Repository:
         res.raise_for_status()
         tcyml = res.text
 
-        return yaml.safe_load(tcyml)
+        return yml.safe_load(tcyml)
 
     @redo.retriable(
         attempts=5,
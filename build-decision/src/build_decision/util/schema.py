@@ -4,10 +4,11 @@
 
 
 import attr
-import yaml
 from jsonschema.validators import validator_for
 from referencing import Registry
 
+from . import yml
+
 
 def _get_validator(schema):
     # jsonschema by default allows remote references in the schema, so we
@@ -30,7 +31,7 @@ class Schema:
 
     @classmethod
     def from_file(cls, path):
-        schema = yaml.safe_load(path.read_text())
+        schema = yml.safe_load(path.read_text())
         return cls(schema)
 
     def validate(self, value):
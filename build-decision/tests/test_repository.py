@@ -1,8 +1,8 @@
 import pytest
 import redo
-import yaml
 
 import build_decision.repository as repository
+from build_decision.util import yml
 
 from . import fake_redo_retry
 
@@ -82,7 +82,7 @@ def test_get_file(mocker, repository_type, repo_url, revision, raises, expected_
     fake_session = mocker.MagicMock()
 
     mocker.patch.object(repository, "SESSION", new=fake_session)
-    mocker.patch.object(yaml, "safe_load")
+    mocker.patch.object(yml, "safe_load")
 
     repo = repository.Repository(
         repo_url=repo_url,
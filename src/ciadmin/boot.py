@@ -2,6 +2,7 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file, You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
+import importlib
 import os
 import re
 import sys
@@ -11,31 +12,42 @@ from tcadmin.appconfig import AppConfig
 from tcadmin.main import main
 
 from ciadmin import modify
-from ciadmin.generate import (
-    clients,
-    cron_tasks,
-    git_pushes,
-    grants,
-    hg_pushes,
-    hooks,
-    in_tree_actions,
-    scm_group_roles,
-    worker_pools,
-)
+from ciadmin.util import cache, orchestration
 
+# Resource generators, by name.  Each module is only imported when its
+# resources are selected, so that `--help` and runs for a subset of resources
+# do not pay for importing every generator (and its dependencies).
 RESOURCES = {
-    "clients": clients.update_resources,
-    "cron_tasks": cron_tasks.update_resources,
-    "git_pushes": git_pushes.update_resources,
-    "grants": grants.update_resources,
-    "hg_pushes": hg_pushes.update_resources,
-    "hooks": hooks.update_resources,
-    "in_tree_actions": in_tree_actions.update_resources,
-    "scm_group_roles": scm_group_roles.update_resources,
-    "worker_pools": worker_pools.update_resources,
+    "clients": "ciadmin.generate.clients",
+    "cron_tasks": "ciadmin.generate.cron_tasks",
+    "git_pushes": "ciadmin.generate.git_pushes",
+    "grants": "ciadmin.generate.grants",
+    "hg_pushes": "ciadmin.generate.hg_pushes",
+    "hooks": "ciadmin.generate.hooks",
+    "in_tree_actions": "ciadmin.generate.in_tree_actions",
+    "scm_group_roles": "ciadmin.generate.scm_group_roles",
+    "worker_pools": "ciadmin.generate.worker_pools",
 }
 
+PROFILE_HELP = (
+    "Write wall time, CPU time, peak memory, HTTP requests and cache hit rates "
+    "for each resource generator to this JSON file (or set CIADMIN_PROFILE); "
+    "add --cprofile for cProfile dumps"
+)
+NO_CACHE_HELP = "Do not use the on-disk cache of parsed config and generated resources"
+CPROFILE_HELP = (
+    "With --profile, also write a cProfile dump for each resource generator "
+    "next to the JSON file (or set CIADMIN_CPROFILE=1)"
+)
+
+
+def get_generator(resource):
+    "Import the named resource's module and return its `update_resources`"
+    return importlib.import_module(RESOURCES[resource]).update_resources
+
+
 appconfig = AppConfig()
+appconfig.generators = orchestration.GeneratorRegistry("generators")
 
 appconfig.options.add(
     "--environment",
@@ -43,6 +55,22 @@ appconfig.options.add(
     help="environment for which resources are to be generated",
 )
 
+appconfig.options.add(
+    "--jobs",
+    help="number of processes to use when generating worker pools (default: 1)",
+)
+
+appconfig.options.add(
+    "--hook-status-concurrency",
+    help="number of in-tree action hook statuses to fetch at once (default: 20)",
+)
+
+appconfig.options.add(
+    "--hook-status-ttl",
+    help="seconds to reuse locally cached in-tree action hook statuses for, "
+    "except in `apply`, which always fetches them (default: 0, disabled)",
+)
+
 appconfig.check_path = os.path.join(os.path.dirname(__file__), "check")
 
 appconfig.modifiers.register(modify.modify_resources)
@@ -71,16 +99,57 @@ def boot():
         default="all",
         help=f"Comma-separated list of resources to generate. Allowed values are: all,{','.join(RESOURCES.keys())}",
     )
-    def register_resources_and_run(resources: str):
+    @click.option(
+        "--no-cache",
+        is_flag=True,
+        default=False,
+        help=NO_CACHE_HELP,
+    )
+    @click.option(
+        "--profile",
+        envvar="CIADMIN_PROFILE",
+        default=None,
+        help=PROFILE_HELP,
+    )
+    @click.option(
+        "--cprofile",
+        envvar="CIADMIN_CPROFILE",
+        is_flag=True,
+        default=False,
+        help=CPROFILE_HELP,
+    )
+    def register_resources_and_run(
+        resources: str, no_cache: bool, profile: str, cprofile: bool
+    ):
+        if no_cache:
+            click.echo("Not using the on-disk cache", err=True)
+            cache.enabled = False
+
+        def register(reso):
+            generator = get_generator(reso)
+            if profiler:
+                generator = profiler.wrap(reso, generator)
+            appconfig.generators.register(generator)
+
+        profiler = None
+        if profile:
+            from ciadmin.util.profiling import Profiler  # noqa: PLC0415
+
+            click.echo(
+                f"Writing a profile of resource generation to {profile}", err=True
+            )
+            profiler = Profiler(profile, cprofile=cprofile)
+            orchestration.offload_cpu = False
+
         resources_list = resources.split(",")
         if "all" in resources_list:
-            for reso_module in RESOURCES.values():
-                appconfig.generators.register(reso_module)
+            for reso in RESOURCES:
+                register(reso)
         else:
             for reso in resources_list:
-                if resource_module := RESOURCES.get(reso, None):
+                if reso in RESOURCES:
                     click.echo(f"Registering resource: {reso}", err=True)
-                    appconfig.generators.register(resource_module)
+                    register(reso)
                 else:
                     click.echo(f"Ignoring invalid resource: {reso}.", err=True)
             if "clients" not in resources_list:
@@ -91,14 +160,18 @@ def boot():
 
                 clients.fetch_clients = fetch_clients
 
-        # Remove the --resources arguments from sys.argv so inner "click.command"s don't complain
-        # Handle parameter with =
-        arg_regex = re.compile(r"^--resources\=.*")
-        sys.argv = [arg for arg in sys.argv if not arg_regex.match(arg)]
-        # Handle parameter with space
-        while "--resources" in sys.argv:
-            reso_arg_index = sys.argv.index("--resources")
-            sys.argv = sys.argv[:reso_arg_index] + sys.argv[reso_arg_index + 2 :]
+        # Remove the --resources and --profile arguments from sys.argv so inner
+        # "click.command"s don't complain
+        for option in ("--resources", "--profile"):
+            # Handle parameter with =
+            arg_regex = re.compile(rf"^{option}\=.*")
+            sys.argv = [arg for arg in sys.argv if not arg_regex.match(arg)]
+            # Handle parameter with space
+            while option in sys.argv:
+                arg_index = sys.argv.index(option)
+                sys.argv = sys.argv[:arg_index] + sys.argv[arg_index + 2 :]
+        # Likewise for the flags
+        sys.argv = [arg for arg in sys.argv if arg not in ("--no-cache", "--cprofile")]
 
         main(appconfig)
 
@@ -110,6 +183,13 @@ def boot():
             default="all",
             help=f"Comma-separated list of resources to generate. Allowed values are: all,{','.join(RESOURCES.keys())}",
         )
+        appconfig.options.add("--profile", help=PROFILE_HELP)
+        # OptionsRegistry.add only supports options taking a value
+        for option, help in (
+            ("--no-cache", NO_CACHE_HELP),
+            ("--cprofile", CPROFILE_HELP),
+        ):
+            appconfig.options.option_args[option] = {"is_flag": True, "help": help}
         main(appconfig)
     else:
         register_resources_and_run()
@@ -3,16 +3,15 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 
 import pytest
-import yaml
 from tcadmin.util.sessions import with_aiohttp_session
 
 from ciadmin.generate import tcyml
 from ciadmin.generate.ciconfig.projects import Project
-from ciadmin.util import github
+from ciadmin.util import github, yml
 
 
 async def _get_pull_request_policy(project):
-    config = yaml.safe_load(
+    config = yml.safe_load(
         await tcyml.get(
             project.repo,
             repo_type=project.repo_type,
@@ -4,11 +4,81 @@
 
 from asyncio import Lock
 
-from ciadmin.util import github
+from ciadmin.util import cache, github
 
 _cache = {}
 _lock = {}
 
+# 100 is the maximum allowed
+# https://docs.github.com/en/rest/branches/branches?apiVersion=2022-11-28#list-branches
+PER_PAGE = 100
+
+
+async def _get_page(client, endpoint, params, headers):
+    """
+    Fetch one page of branches, returning (branch names, link header).
+
+    Pages are cached on disk along with their ETag and Last-Modified headers,
+    and revalidated with a conditional request; GitHub does not count 304
+    responses against the rate limit.
+
+    The validators only cover the page's body, not its link header.  A full
+    last page is therefore always fetched again, as a new branch sorting
+    after it would add a next page without changing this one.
+    """
+    cache_key = f"{endpoint} {sorted(params.items())}"
+    cached = cache.load("github-branches", cache_key)
+    if cached and (
+        len(cached["branches"]) >= params["per_page"]
+        and 'rel="next"' not in cached["link"]
+    ):
+        cached = None
+    headers = dict(headers)
+    if cached:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = await client.request("GET", endpoint, headers=headers, params=params)
+    if cached and response.status == 304:
+        return cached["branches"], cached["link"]
+    if not response.ok:
+        detail = await response.text()
+        print(
+            f"Got error when querying {endpoint}: "
+            f"{response.status} {response.reason}: {detail}"
+        )
+        response.raise_for_status()
+    result = await response.json()
+    branches = [b["name"] for b in result]
+    link = response.headers.get("link", "")
+
+    etag = response.headers.get("etag")
+    last_modified = response.headers.get("last-modified")
+    if etag or last_modified:
+        cache.store(
+            "github-branches",
+            cache_key,
+            {
+                "etag": etag,
+                "last_modified": last_modified,
+                "branches": branches,
+                "link": link,
+            },
+        )
+    return branches, link
+
+
+def prime(repo_path, branches):
+    """
+    Record the branches of `repo_path`, fetched by other means (see
+    `github.get_branches_bulk`), so that `get` need not fetch them.
+    """
+    if repo_path.endswith("/"):
+        repo_path = repo_path[:-1]
+    _cache.setdefault(repo_path, branches)
+
 
 # TODO: support private repositories. this will most likely require querying
 # GitHub as an app.
@@ -22,9 +92,7 @@ async def get(repo_path, repo_type="git"):
         repo_path = repo_path[:-1]
     branches_endpoint = f"/repos/{repo_path}/branches"
 
-    # 100 is the maximum allowed
-    # https://docs.github.com/en/rest/branches/branches?apiVersion=2022-11-28#list-branches
-    params = {"per_page": 100}
+    params = {"per_page": PER_PAGE}
     headers = {}
 
     async with _lock.setdefault(repo_path, Lock()):
@@ -34,18 +102,8 @@ async def get(repo_path, repo_type="git"):
         client = await github.get_client()
         branches = []
         while branches_endpoint:
-            response = await client.request(
-                "GET", branches_endpoint, headers=headers, params=params
-            )
-            if not response.ok:
-                detail = await response.text()
-                print(
-                    f"Got error when querying {branches_endpoint}: "
-                    f"{response.status} {response.reason}: {detail}"
-                )
-                response.raise_for_status()
-            result = await response.json()
-            branches.extend([b["name"] for b in result])
+            page, link = await _get_page(client, branches_endpoint, params, headers)
+            branches.extend(page)
             # If `link` is present in the response it will contain
             # pagination information. We need to examine it to see
             # if there are additional pages of results to fetch.
@@ -54,7 +112,7 @@ async def get(repo_path, repo_type="git"):
             # This icky parsing can probably go away when we switch
             # to a GitHub app, as we'll likely be using a proper
             # client at that point.
-            for l in response.headers.get("link", "").split(","):
+            for l in link.split(","):
                 if 'rel="next"' in l:
                     branches_endpoint = l.split(">")[0].split("<")[1]
                     branches_endpoint = branches_endpoint[
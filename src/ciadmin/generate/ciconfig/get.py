@@ -2,21 +2,40 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file, You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
+import hashlib
 import os
 from asyncio import Lock
 
 import yaml
 
+from ...util import cache, yml
+
 _cache = {}
 _lock = {}
 
+_MISSING = object()
+
+
+def _parse_yml(data):
+    """
+    Parse the given YAML bytes, consulting the on-disk cache first.  The cache is
+    keyed by the content hash, so an entry is never stale: editing the file
+    changes the key.
+    """
+    key = f"{yaml.__version__}:{yml.Loader.__name__}:{hashlib.sha256(data).hexdigest()}"
+    result = cache.load("ciconfig", key, _MISSING)
+    if result is _MISSING:
+        result = yml.safe_load(data)
+        cache.store("ciconfig", key, result)
+    return result
+
 
 async def _read_file(filename, **test_kwargs):
     with open(filename, "rb") as f:
         result = f.read()
 
     if filename.endswith(".yml"):
-        result = yaml.safe_load(result)
+        result = _parse_yml(result)
 
     return result
 
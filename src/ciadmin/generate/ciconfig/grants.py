@@ -2,17 +2,82 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file, You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
+import string
+
 import attr
 
 from ...util.matching import grantees
 from .get import get_ciconfig_dir
 
 
+class ScopeTemplate:
+    """
+    A grant scope, parsed once so that it can be rendered repeatedly.
+
+    `render(subs)` returns the same result as `scope.format(**subs)`, including
+    raising KeyError for unknown placeholders.  Scopes without placeholders are
+    rendered up-front, and scopes using anything beyond plain `{name}`
+    placeholders (format specs, conversions, indexing) are left to str.format.
+    """
+
+    __slots__ = ("scope", "fields", "_text", "_parts")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.fields = frozenset()
+        self._text = None
+        self._parts = None
+
+        try:
+            parsed = list(string.Formatter().parse(scope))
+        except ValueError:
+            # malformed; let str.format raise when this is rendered
+            return
+        parts = []
+        for literal, field_name, format_spec, conversion in parsed:
+            if field_name is None:
+                parts.append((literal, None))
+            elif field_name.isidentifier() and not format_spec and not conversion:
+                parts.append((literal, field_name))
+            else:
+                return
+        self.fields = frozenset(name for _, name in parts if name is not None)
+        if self.fields:
+            self._parts = parts
+        else:
+            self._text = "".join(literal for literal, _ in parts)
+
+    def render(self, subs):
+        if self._text is not None:
+            return self._text
+        if self._parts is None:
+            return self.scope.format(**subs)
+        return "".join(
+            literal + format(subs[name], "") if name is not None else literal
+            for literal, name in self._parts
+        )
+
+
+def _scope_templates(scopes):
+    # invalid scopes are reported by Grant's validator
+    if not isinstance(scopes, list):
+        return []
+    return [ScopeTemplate(s) if isinstance(s, str) else None for s in scopes]
+
+
 @attr.s(frozen=True)
 class Grant:
     scopes = attr.ib(type=list, factory=lambda: [])
     grantees = attr.ib(type=list, factory=lambda: [])
     environments = attr.ib(type=list, default=None)
+    scope_templates = attr.ib(
+        init=False,
+        eq=False,
+        repr=False,
+        default=attr.Factory(
+            lambda self: _scope_templates(self.scopes), takes_self=True
+        ),
+    )
 
     @scopes.validator
     def validate_scopes(self, attribute, value):
@@ -4,11 +4,11 @@
 
 from tcadmin.resources import Client
 
+from ..util.matching import project_match
 from .ciconfig.clients import Client as ClientConfig
 from .ciconfig.clients_interpreted import Client as InterpretedClientConfig
 from .ciconfig.environment import Environment
 from .ciconfig.projects import Project
-from .grants import project_match
 
 
 async def update_resources(resources):
@@ -5,19 +5,20 @@
 import re
 
 from tcadmin.resources import Role
-from tcadmin.util.scopes import normalizeScopes
 
 from ..util.matching import (
     GroupGrantee,
     ProjectGrantee,
+    ProjectIndex,
     RoleGrantee,
     branch_match,
     glob_match,
-    project_match,
 )
+from ..util.orchestration import run_cpu_bound
+from ..util.scopes import ScopeSet
 from .ciconfig.environment import Environment
 from .ciconfig.externally_managed import manage_with_exclusions
-from .ciconfig.grants import Grant
+from .ciconfig.grants import Grant, ScopeTemplate
 from .ciconfig.projects import Project
 
 LEVEL_PRIORITIES = {1: "low", 2: "low", 3: "highest"}
@@ -41,14 +42,10 @@ def format_role_id(project, job, pr_policy):
         return f"{project.role_prefix}:{suffix}"
 
 
-def format_scope(project, scope, level, priority):
-    # perform substitutions as grant file describes
+def project_substitutions(project):
+    "Get the scope substitutions that depend only on the project"
     subs = {}
     subs["alias"] = project.alias
-    if level:
-        subs["level"] = level
-    if priority:
-        subs["priority"] = priority
     if project.trust_domain:
         subs["trust_domain"] = project.trust_domain
     if project.trust_project:
@@ -61,14 +58,42 @@ def format_scope(project, scope, level, priority):
     except AttributeError:
         pass  # not an known supported repo..
 
-    return scope.format(**subs)
+    return subs
 
 
-def add_scopes_for_projects(grant, grantee, add_scope, projects):
-    for project in projects:
-        if not project_match(grantee, project):
-            continue
+def scope_substitutions(project, level, priority, substitutions=None):
+    """
+    Get the scope substitutions for the given project, level and priority.  If
+    given, `substitutions` caches the project's own substitutions, keyed by
+    id(project), so that they are computed only once per run.
+    """
+    if substitutions is None:
+        subs = project_substitutions(project)
+    else:
+        try:
+            subs = substitutions[id(project)]
+        except KeyError:
+            subs = substitutions[id(project)] = project_substitutions(project)
+
+    # perform substitutions as grant file describes
+    subs = dict(subs)
+    if level:
+        subs["level"] = level
+    if priority:
+        subs["priority"] = priority
+    return subs
 
+
+def format_scope(project, scope, level, priority):
+    if not isinstance(scope, ScopeTemplate):
+        scope = ScopeTemplate(scope)
+    return scope.render(scope_substitutions(project, level, priority))
+
+
+def add_scopes_for_projects(grant, grantee, add_scope, projects, substitutions=None):
+    # `projects` is a ProjectIndex, which avoids checking every project against
+    # every grantee; `substitutions` is passed on to scope_substitutions
+    for project in projects.matching(grantee):
         branch_jobs = set()
         non_branch_jobs = set()
         for job in grantee.job:
@@ -178,8 +203,9 @@ def add_scopes_for_projects(grant, grantee, add_scope, projects):
             if job.startswith("pull-request") or job.startswith("pr-action"):
                 level = 1
 
-            for scope in grant.scopes:
-                add_scope(roleId, format_scope(project, scope, level, priority))
+            subs = scope_substitutions(project, level, priority, substitutions)
+            for scope in grant.scope_templates:
+                add_scope(roleId, scope.render(subs))
 
         for branch in project.branches:
             if not branch_match(grantee, branch):
@@ -207,48 +233,42 @@ def add_scopes_for_projects(grant, grantee, add_scope, projects):
                 roleId = format_role_id(project, f"branch:{branch.name}", "")
                 priority = LEVEL_PRIORITIES[level]
 
-                for scope in grant.scopes:
-                    add_scope(roleId, format_scope(project, scope, level, priority))
+                subs = scope_substitutions(project, level, priority, substitutions)
+                for scope in grant.scope_templates:
+                    add_scope(roleId, scope.render(subs))
 
 
 def add_scopes_for_groups(grant, grantee, add_scope):
     for group in grantee.groups:
         roleId = f"project:releng:ci-group:{group}"
-        for scope in grant.scopes:
-            # use an empty format() to catch any stray {..} in the scope
-            add_scope(roleId, scope.format())
+        for scope in grant.scope_templates:
+            # render with no substitutions to catch any stray {..} in the scope
+            add_scope(roleId, scope.render({}))
 
 
 def add_scopes_for_roles(grant, grantee, add_scope):
     for role in grantee.roles:
-        for scope in grant.scopes:
-            # use an empty format() to catch any stray {..} in the scope
-            add_scope(role, scope.format())
+        for scope in grant.scope_templates:
+            # render with no substitutions to catch any stray {..} in the scope
+            add_scope(role, scope.render({}))
 
 
-async def update_resources(resources):
+def grant_scopes(grants, projects, environment):
     """
-    Manage the scopes granted to projects.  This file interprets `grants.d` yml files
-    in fxci-config. Its behavior is largely documented in the comment in that file.
+    Calculate the scopes granted to each role in the given environment,
+    returning a dictionary mapping roleId to a ScopeSet.
     """
-
-    grants = await Grant.fetch_all()
-    projects = await Project.fetch_all()
-    environment = await Environment.current()
-
-    # manage our resources, excluding externally managed patterns
-    resources.manage("Role=mozilla-group:.*")
-    resources.manage("Role=mozillians-group:.*")
-    resources.manage("Role=login-identity:.*")
-    await manage_with_exclusions(resources, "Role=hook-id:.*")
-    await manage_with_exclusions(resources, "Role=project:.*")
-    resources.manage("Role=repo:.*")
-
-    # calculate scopes..
+    # scopes are normalized as they are added
     roles = {}
+    # id(project) -> project substitutions; `projects` holds a reference to
+    # each project for the duration of the call, so ids are not reused
+    substitutions = {}
 
     def add_scope(roleId, scope):
-        roles.setdefault(roleId, []).append(scope)
+        try:
+            roles[roleId].add(scope)
+        except KeyError:
+            roles[roleId] = ScopeSet([scope])
 
     for grant in grants:
         if grant.environments and environment.name not in grant.environments:
@@ -256,7 +276,9 @@ async def update_resources(resources):
             continue
         for grantee in grant.grantees:
             if isinstance(grantee, ProjectGrantee):
-                add_scopes_for_projects(grant, grantee, add_scope, projects)
+                add_scopes_for_projects(
+                    grant, grantee, add_scope, projects, substitutions
+                )
             elif isinstance(grantee, GroupGrantee):
                 add_scopes_for_groups(grant, grantee, add_scope)
             elif isinstance(grantee, RoleGrantee):
@@ -264,12 +286,36 @@ async def update_resources(resources):
             else:
                 raise RuntimeError("unknown grantee!")
 
+    return roles
+
+
+async def update_resources(resources):
+    """
+    Manage the scopes granted to projects.  This file interprets `grants.d` yml files
+    in fxci-config. Its behavior is largely documented in the comment in that file.
+    """
+
+    grants = await Grant.fetch_all()
+    projects = ProjectIndex(await Project.fetch_all())
+    environment = await Environment.current()
+
+    # manage our resources, excluding externally managed patterns
+    resources.manage("Role=mozilla-group:.*")
+    resources.manage("Role=mozillians-group:.*")
+    resources.manage("Role=login-identity:.*")
+    await manage_with_exclusions(resources, "Role=hook-id:.*")
+    await manage_with_exclusions(resources, "Role=project:.*")
+    resources.manage("Role=repo:.*")
+
+    # calculate scopes (off the event loop, as this is CPU-bound)..
+    roles = await run_cpu_bound(grant_scopes, grants, projects, environment)
+
     # ..and add the roles
-    for roleId, scopes in roles.items():
+    for roleId, scopes in sorted(roles.items()):
         resources.manage(f"Role={re.escape(roleId)}")
         role = Role(
             roleId=roleId,
-            scopes=normalizeScopes(scopes),
+            scopes=scopes.normalized(),
             description="Scopes in this role are defined in "
             "[fxci-config/grants.d]"
             "(https://github.com/mozilla-releng/fxci-config/blob/main/grants.d).",
@@ -7,9 +7,9 @@ import re
 import string
 
 import attr
-import yaml
 from tcadmin.resources import Binding, Hook, Role
 
+from ..util import yml
 from ..util.keyed_by import resolve_keyed_by
 from .ciconfig.externally_managed import (
     manage_individual,
@@ -100,9 +100,7 @@ async def update_resources(resources):
         manage_individual(resources, f"Role=hook-id:{hook_name}")
 
         with open(hook.template_file) as f:
-            task = yaml.safe_load(
-                HookInterpolator(f.read()).substitute(hook.attributes)
-            )
+            task = yml.safe_load(HookInterpolator(f.read()).substitute(hook.attributes))
 
         resources.add(
             Role(roleId="hook-id:" + hook_name, description="", scopes=hook.scopes)
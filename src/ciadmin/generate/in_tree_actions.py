@@ -7,18 +7,20 @@ import datetime
 import functools
 import hashlib
 import textwrap
+import time
 
 import aiohttp
-import yaml
+import click
 from taskcluster import optionsFromEnvironment
 from taskcluster.aio import Hooks
 from taskcluster.exceptions import TaskclusterRestFailure
+from tcadmin.appconfig import AppConfig
 from tcadmin.resources import Hook, Role
 from tcadmin.util.matchlist import MatchList
 from tcadmin.util.scopes import normalizeScopes
 from tcadmin.util.sessions import aiohttp_session
 
-from ciadmin.util import github
+from ciadmin.util import cache, github, yml
 from ciadmin.util.matching import glob_match
 
 from . import branches, tcyml
@@ -31,6 +33,21 @@ from .ciconfig.projects import Project
 # to support try jobs run against old revisions.
 HOOK_RETENTION_TIME = datetime.timedelta(days=60)
 
+# The number of hook statuses to fetch at once, unless overridden with
+# --hook-status-concurrency.
+HOOK_STATUS_CONCURRENCY = 20
+
+# The Hooks client retries connection failures and server errors itself;
+# get_hook_status makes this many attempts when a request times out, which the
+# client does not retry.
+HOOK_STATUS_ATTEMPTS = 3
+
+# Hook statuses can be kept in a local snapshot for --hook-status-ttl seconds,
+# so that repeated runs of `diff` or `check` need not fetch them all again.  A
+# TTL of 0, the default, disables the snapshot.  `apply` always fetches them, as
+# it deletes hooks based on when they last fired.
+HOOK_STATUS_TTL = 0
+
 
 def should_hash(project):
     if project.feature("gecko-actions"):
@@ -63,6 +80,60 @@ async def get_project_branches(project):
     raise Exception(f"unsupported repo type {project.repo_type} for {project.alias}")
 
 
+def get_configured_branches(project):
+    """
+    Get the branch globs for which `.taskcluster.yml` files are hashed.
+    """
+    # If "*" is a configured branch we explicitly ignore it; otherwise
+    # we could end up fetching 100s or 1000s of tcymls and generating
+    # hooks for them. Substring globs may still exist, and are
+    # supported.
+    configured_branches = [b.name for b in project.branches if b.name != "*"]
+    # The default branch is considered to be _always_ configured, even if
+    # not explicitly named in `branches`. This is primarily to ensure that
+    # cases where `*` is the only branch explicitly listed, that we still
+    # generate actions for the default branch.
+    configured_branches.append(project.default_branch)
+    return configured_branches
+
+
+async def prefetch_github_tcymls(projects):
+    """
+    Fetch the branches and `.taskcluster.yml` files of the given projects'
+    GitHub repositories in a few batched GraphQL queries, priming the caches
+    used by `branches.get` and `tcyml.get`.  Anything that cannot be fetched
+    this way is left for those functions to fetch over REST as usual.
+    """
+    if not github.graphql_available():
+        return
+
+    github_projects = [
+        p
+        for p in projects
+        if p.repo_type == "git"
+        and p.repo.startswith(("https://github.com/", "git@github.com:"))
+    ]
+    repos = sorted({p.repo_path.rstrip("/") for p in github_projects})
+    repo_branches = await github.get_branches_bulk(repos)
+    for repo, names in repo_branches.items():
+        branches.prime(repo, names)
+
+    wanted = []
+    for p in github_projects:
+        configured_branches = get_configured_branches(p)
+        for b in repo_branches.get(p.repo_path.rstrip("/"), []):
+            if glob_match(configured_branches, b):
+                wanted.append((p, b))
+    contents = await github.get_files_bulk(
+        sorted({(tcyml.github_repo(p.repo), b) for p, b in wanted}),
+        ".taskcluster.yml",
+    )
+    for p, b in wanted:
+        key = (tcyml.github_repo(p.repo), b)
+        if key in contents:
+            tcyml.prime_github(p.repo, b, contents[key])
+
+
 async def hash_taskcluster_ymls():
     """
     Download and hash .taskcluster.yml from every project repository.  Returns
@@ -75,22 +146,45 @@ async def hash_taskcluster_ymls():
     def hash(val):
         return hashlib.sha256(val).hexdigest()[:10]
 
+    # many branches (and forks) share identical .taskcluster.yml files, so
+    # parse and hash each distinct file only once
+    parsed_tcymls = {}
+
+    def parse(tcy):
+        """
+        Parse and hash a .taskcluster.yml, returning (parsed, hash), or None if it
+        cannot be used.
+        """
+        if tcy in parsed_tcymls:
+            return parsed_tcymls[tcy]
+        parsed_tcymls[tcy] = None
+
+        # some old projects have .taskcluster.yml's that are not valid YAML
+        # (back in the day, mozilla-taskcluster used mustache to templatize
+        # the text before parsing it..). Ignore those projects.
+        try:
+            parsed = yml.safe_load(tcy)
+        except Exception:
+            return None
+
+        # some slightly less old projects have
+        # {tasks: $let: .., in: [..]} instead of the expected
+        # {tasks: [{$let: .., in: ..}]}.  Those can be ignored too.
+        if not isinstance(parsed["tasks"], list):
+            return None
+
+        parsed_tcymls[tcy] = (parsed, hash(tcy))
+        return parsed_tcymls[tcy]
+
     tcyml_projects = list(filter(should_hash, projects))
+    await prefetch_github_tcymls(tcyml_projects)
+
     futures = []
     rv = {}
     for p in tcyml_projects:
         rv[p.alias] = {}
 
-        # If "*" is a configured branch we explicitly ignore it; otherwise
-        # we could end up fetching 100s or 1000s of tcymls and generating
-        # hooks for them. Substring globs may still exist, and are
-        # supported.
-        configured_branches = [b.name for b in p.branches if b.name != "*"]
-        # The default branch is considered to be _always_ configured, even if
-        # not explicitly named in `branches`. This is primarily to ensure that
-        # cases where `*` is the only branch explicitly listed, that we still
-        # generate actions for the default branch.
-        configured_branches.append(p.default_branch)
+        configured_branches = get_configured_branches(p)
         for b in await get_project_branches(p):
             if glob_match(configured_branches, b):
 
@@ -108,29 +202,22 @@ async def hash_taskcluster_ymls():
                     if not tcy:
                         return
 
-                    # some old projects have .taskcluster.yml's that are not valid YAML
-                    # (back in the day, mozilla-taskcluster used mustache to templatize
-                    # the text before parsing it..). Ignore those projects.
-                    try:
-                        parsed = yaml.safe_load(tcy)
-                    except Exception:
-                        return
-
-                    # some slightly less old projects have
-                    # {tasks: $let: .., in: [..]} instead of the expected
-                    # {tasks: [{$let: .., in: ..}]}.  Those can be ignored too.
-                    if not isinstance(parsed["tasks"], list):
+                    parsed_and_hash = parse(tcy)
+                    if parsed_and_hash is None:
                         return
+                    parsed, tcy_hash = parsed_and_hash
 
                     rv[project.alias][branch_name] = {
                         "parsed": parsed,
-                        "hash": hash(tcy),
+                        "hash": tcy_hash,
                         "level": project.get_level(branch_name),
                         "alias": project.alias,
                     }
 
                 future = asyncio.ensure_future(
-                    tcyml.get(p.repo, repo_type=p.repo_type, default_branch=b)
+                    tcyml.get(
+                        p.repo, repo_type=p.repo_type, default_branch=b, missing_ok=True
+                    )
                 )
                 future.add_done_callback(functools.partial(process, p, b))
                 futures.append(future)
@@ -143,22 +230,166 @@ async def hash_taskcluster_ymls():
     return rv
 
 
-def make_hook(action, tcyml_content, tcyml_hash, projects, pr=False):
+class TcymlIndex:
+    """
+    An index of hashed .taskcluster.yml files (as returned from
+    `hash_taskcluster_ymls`), built once so that generating each action's hooks
+    is a lookup rather than a pass over every project and branch.
+    """
+
+    def __init__(self):
+        # {(trust_domain, level): {hash: (first seen, parsed content)}}
+        self._hashes = {}
+        # {(level, hash): ["alias, branch: 'name'", ..]}
+        self._matching_projects = {}
+
+    @classmethod
+    async def build(cls, hashed_tcymls, projects):
+        index = cls()
+
+        seen = 0
+        for project in projects:
+            if not should_hash(project) or project.alias not in hashed_tcymls:
+                continue
+            for branch_name in await get_project_branches(project):
+                # Branch didn't exist, or doesn't have a parseable tcyml
+                tcyml = hashed_tcymls[project.alias].get(branch_name)
+                if tcyml is None:
+                    continue
+                hashes = index._hashes.setdefault(
+                    (project.trust_domain, project.get_level(branch_name)), {}
+                )
+                tcyml_hash = tcyml["hash"]
+                first_seen = hashes[tcyml_hash][0] if tcyml_hash in hashes else seen
+                hashes[tcyml_hash] = (first_seen, tcyml["parsed"])
+                seen += 1
+
+        for alias in sorted(hashed_tcymls):
+            for branch_name in sorted(hashed_tcymls[alias]):
+                tcyml = hashed_tcymls[alias][branch_name]
+                index._matching_projects.setdefault(
+                    (str(tcyml["level"]), tcyml["hash"]), []
+                ).append(f"{alias}, branch: '{branch_name}'")
+
+        return index
+
+    def hooks_for(self, trust_domain, level):
+        """
+        Return {hash: parsed content} for the .taskcluster.yml files in the given
+        trust domain at the given level or higher.
+        """
+        hashes = {}
+        for (hashes_trust_domain, hashes_level), by_hash in self._hashes.items():
+            if hashes_trust_domain != trust_domain or hashes_level < level:
+                continue
+            for tcyml_hash, (first_seen, content) in by_hash.items():
+                if tcyml_hash not in hashes or first_seen < hashes[tcyml_hash][0]:
+                    hashes[tcyml_hash] = (first_seen, content)
+        return {
+            tcyml_hash: content
+            for tcyml_hash, (_, content) in sorted(
+                hashes.items(), key=lambda item: item[1][0]
+            )
+        }
+
+    def matching_projects(self, level, tcyml_hash):
+        """
+        Return descriptions of the project branches at this level with this
+        .taskcluster.yml hash.
+        """
+        return self._matching_projects.get((str(level), tcyml_hash), [])
+
+
+async def get_hook_status(hooks, hookGroupId, hookId, attempts=HOOK_STATUS_ATTEMPTS):
+    """
+    Get a hook's status.  The client retries connection failures and server
+    errors; this retries requests that time out.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return await hooks.getHookStatus(hookGroupId, hookId)
+        except TimeoutError:
+            if attempt == attempts:
+                raise
+            await asyncio.sleep(0.5 * 2**attempt)
+
+
+def hook_status_ttl():
+    "The hook status snapshot TTL to use for the current command"
+    ctx = click.get_current_context(silent=True)
+    if ctx is not None and ctx.command.name == "apply":
+        return 0
+    return int(AppConfig.current().options.get("--hook-status-ttl") or HOOK_STATUS_TTL)
+
+
+async def get_hook_statuses(
+    hooks, hook_ids, concurrency=HOOK_STATUS_CONCURRENCY, ttl=0
+):
+    """
+    Get the status of each of the given (hookGroupId, hookId) pairs, with at most
+    `concurrency` requests in flight at once.  Returns {(hookGroupId, hookId):
+    status}.  Progress and timing are reported on stderr.
+
+    If `ttl` is nonzero, statuses fetched less than `ttl` seconds ago are taken
+    from the local snapshot for this deployment, and only the rest are fetched.
+    """
+    now = time.time()
+    snapshot = {}
+    if ttl > 0:
+        snapshot_key = hooks.options["rootUrl"]
+        snapshot = {
+            hook_id: entry
+            for hook_id, entry in cache.load("hook-status", snapshot_key, {}).items()
+            if now - entry[0] < ttl
+        }
+    statuses = {
+        hook_id: snapshot[hook_id][1] for hook_id in hook_ids if hook_id in snapshot
+    }
+    to_fetch = [hook_id for hook_id in hook_ids if hook_id not in statuses]
+    if statuses:
+        click.echo(
+            f"Using {len(statuses)} in-tree action hook statuses from the local "
+            f"snapshot; fetching {len(to_fetch)}",
+            err=True,
+        )
+
+    semaphore = asyncio.Semaphore(concurrency)
+    total = len(to_fetch)
+    done = 0
+    started = time.monotonic()
+
+    async def fetch(hookGroupId, hookId):
+        nonlocal done
+        async with semaphore:
+            status = await get_hook_status(hooks, hookGroupId, hookId)
+        done += 1
+        # report roughly every 10%
+        if done == total or done % max(total // 10, 1) == 0:
+            click.echo(
+                f"Fetched {done}/{total} in-tree action hook statuses "
+                f"({time.monotonic() - started:.1f}s)",
+                err=True,
+            )
+        return status
+
+    fetched = await asyncio.gather(*(fetch(*hook_id) for hook_id in to_fetch))
+    statuses.update(zip(to_fetch, fetched))
+
+    if ttl > 0 and to_fetch:
+        snapshot.update((hook_id, (now, statuses[hook_id])) for hook_id in to_fetch)
+        cache.store("hook-status", snapshot_key, snapshot)
+
+    return {hook_id: statuses[hook_id] for hook_id in hook_ids}
+
+
+def make_hook(action, tcyml_content, tcyml_hash, tcyml_index, pr=False):
     hookGroupId = f"project-{action.trust_domain}"
     hookId = "in-tree-{}action-{}-{}/{}".format(
         "pr-" if pr else "", action.level, action.action_perm, tcyml_hash
     )
 
     # making matching project list for description field
-
-    matching_projects = []
-    for key in sorted(projects):
-        project = projects[key]
-        for branch in sorted(project):
-            if project[branch]["hash"] == tcyml_hash and str(action.level) == str(
-                project[branch]["level"]
-            ):
-                matching_projects.append(f"{key}, branch: '{branch}'")
+    matching_projects = tcyml_index.matching_projects(action.level, tcyml_hash)
 
     # schema-generation utilities
 
@@ -357,34 +588,16 @@ async def update_resources(resources):
                 (project.trust_domain, project.get_level(branch.name)), []
             ).append(project)
 
+    tcyml_index = await TcymlIndex.build(hashed_tcymls, projects)
+
     # generate the hooks themselves and corresponding hook-id roles
     added_hooks = set()
     for action in actions:
         # gather the hashes at the action's level or higher
-        hooks_to_make = {}  # {hash: content}, for uniqueness
-        for project in projects:
-            if not should_hash(project):
-                continue
-
-            for branch_name in await get_project_branches(project):
-                if project.alias not in hashed_tcymls:
-                    continue
-                if branch_name not in hashed_tcymls[project.alias]:
-                    # Branch didn't exist, or doesn't have a parseable tcyml
-                    continue
-                if project.get_level(branch_name) < action.level:
-                    continue
-                if project.trust_domain != action.trust_domain:
-                    continue
-
-                content, hash = (
-                    hashed_tcymls[project.alias][branch_name]["parsed"],
-                    hashed_tcymls[project.alias][branch_name]["hash"],
-                )
-                hooks_to_make[hash] = content
+        hooks_to_make = tcyml_index.hooks_for(action.trust_domain, action.level)
 
         for hash, content in hooks_to_make.items():
-            hook = make_hook(action, content, hash, hashed_tcymls)
+            hook = make_hook(action, content, hash, tcyml_index)
             resources.add(hook)
             added_hooks.add(hook.id)
             if action.level == 1 and any(
@@ -392,7 +605,7 @@ async def update_resources(resources):
                 for p in projects
                 if p.trust_domain == action.trust_domain
             ):
-                hook = make_hook(action, content, hash, hashed_tcymls, True)
+                hook = make_hook(action, content, hash, tcyml_index, True)
                 resources.add(hook)
                 added_hooks.add(hook.id)
 
@@ -439,6 +652,7 @@ async def update_resources(resources):
         f"Hook=project-{trust_domain}/in-tree-action-*"
         for trust_domain in trust_domains
     )
+    candidates = []
     for trust_domain in trust_domains:
         hookGroupId = f"project-{trust_domain}"
         try:
@@ -459,24 +673,38 @@ async def update_resources(resources):
             if hook.id in added_hooks:
                 continue
 
-            # ignore if the hook has never been fired
-            hookStatus = await hooks.getHookStatus(hook.hookGroupId, hook.hookId)
-            if "lastFire" not in hookStatus or "time" not in hookStatus["lastFire"]:
-                continue
+            candidates.append(hook)
 
-            # ignore if it's too old; do the arithmetic in days to avoid timezone issues
-            last = datetime.datetime.fromisoformat(hookStatus["lastFire"]["time"])
-            age = datetime.date.today() - last.date()
-            if age > HOOK_RETENTION_TIME:
-                continue
+    concurrency = int(
+        AppConfig.current().options.get("--hook-status-concurrency")
+        or HOOK_STATUS_CONCURRENCY
+    )
+    ttl = hook_status_ttl()
+    hook_statuses = await get_hook_statuses(
+        hooks,
+        [(hook.hookGroupId, hook.hookId) for hook in candidates],
+        concurrency,
+        ttl,
+    )
 
-            # we want to keep this hook, so we add it to the "generated"
-            # resources, ensuring it does not get deleted.
-            if "for historical purposes" not in hook.description:
-                description = (
-                    hook.description
-                    + "\n\nThis hook is no longer current and is kept for "
-                    "historical purposes."
-                )
-                hook = hook.evolve(description=description)
-            resources.add(hook)
+    for hook in candidates:
+        # ignore if the hook has never been fired
+        hookStatus = hook_statuses[hook.hookGroupId, hook.hookId]
+        if "lastFire" not in hookStatus or "time" not in hookStatus["lastFire"]:
+            continue
+
+        # ignore if it's too old; do the arithmetic in days to avoid timezone issues
+        last = datetime.datetime.fromisoformat(hookStatus["lastFire"]["time"])
+        age = datetime.date.today() - last.date()
+        if age > HOOK_RETENTION_TIME:
+            continue
+
+        # we want to keep this hook, so we add it to the "generated"
+        # resources, ensuring it does not get deleted.
+        if "for historical purposes" not in hook.description:
+            description = (
+                hook.description + "\n\nThis hook is no longer current and is kept for "
+                "historical purposes."
+            )
+            hook = hook.evolve(description=description)
+        resources.add(hook)
@@ -2,26 +2,128 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file, You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
-from asyncio import Lock
+import json
+from asyncio import Lock, Semaphore
 
 import aiohttp
 from aiohttp_retry import ExponentialRetry, RetryClient
 from tcadmin.util.sessions import aiohttp_session
 
 from ciadmin import USER_AGENT
-from ciadmin.util import github
+from ciadmin.util import cache, github
+
+# The maximum number of concurrent requests to an hg server.
+HG_CONCURRENCY = 8
 
 _cache = {}
 _lock = {}
 
+# id(session) -> HgFetcher, for the active aiohttp session
+_hg_fetchers = {}
+
+
+class HgFetcher:
+    """
+    Fetches files from hg servers over the shared, connection-pooled aiohttp
+    session, with at most HG_CONCURRENCY requests in flight.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.semaphore = Semaphore(HG_CONCURRENCY)
+        self.client = RetryClient(
+            client_session=session,
+            # Despite only setting 404 here, 5xx statuses will still be retried
+            # for. See https://github.com/inyutin/aiohttp_retry?tab=readme-ov-file
+            # for details.
+            retry_options=ExponentialRetry(attempts=5, statuses={404}),
+        )
+        # for callers that expect the file may be missing, and so do not want
+        # to wait out the retries of a 404
+        self.missing_ok_client = RetryClient(
+            client_session=session,
+            retry_options=ExponentialRetry(attempts=5),
+        )
+
+    @staticmethod
+    def get():
+        session = aiohttp_session()
+        fetcher = _hg_fetchers.get(id(session))
+        if fetcher is None or fetcher.session is not session:
+            # forget fetchers for sessions that have since been closed
+            for key, other in list(_hg_fetchers.items()):
+                if other.session.closed:
+                    del _hg_fetchers[key]
+            fetcher = _hg_fetchers[id(session)] = HgFetcher(session)
+        return fetcher
+
+    async def read(self, url, missing_ok=False):
+        """
+        Read the given URL, raising aiohttp.ClientResponseError on failure.  If
+        `missing_ok` is set, a 404 is not retried and returns None.
+        """
+        client = self.missing_ok_client if missing_ok else self.client
+        headers = {"User-Agent": USER_AGENT}
+        async with self.semaphore:
+            async with client.get(url, headers=headers) as response:
+                if missing_ok and response.status == 404:
+                    return None
+                response.raise_for_status()
+                return await response.read()
+
+    async def resolve(self, repo_path, revision, missing_ok=False):
+        """
+        Resolve the given revision (a branch, tag, or short hash) to its full
+        node, returning None if it is not found and `missing_ok` is set.  Full
+        nodes are returned as-is, without a request.
+        """
+        if len(revision) == 40 and all(c in "0123456789abcdef" for c in revision):
+            return revision
+        # the changelog for a single revision, which unlike json-rev carries no
+        # file list or diff
+        url = f"{repo_path}/json-log/{revision}?revcount=1"
+        content = await self.read(url, missing_ok=missing_ok)
+        if content is None:
+            return None
+        return json.loads(content)["node"]
+
+
+def github_repo(repo_path):
+    "Get the `owner/name` of a GitHub repository from its URL"
+    if repo_path.startswith("https://github.com/"):
+        if repo_path.endswith("/"):
+            repo_path = repo_path[:-1]
+        return repo_path.replace("https://github.com/", "")
+    elif repo_path.startswith("git@github.com:"):
+        if repo_path.endswith(".git"):
+            repo_path = repo_path[:-4]
+        return repo_path.replace("git@github.com:", "")
+    else:
+        raise Exception(
+            f"Don't know how to determine file URL for non-github repo: {repo_path}"
+        )
+
+
+def prime_github(repo_path, revision, content):
+    """
+    Record the `.taskcluster.yml` at the given revision of a GitHub repository,
+    fetched by other means (see `github.get_files_bulk`), so that `get` need not
+    fetch it.  A content of None means the file does not exist.
+    """
+    endpoint = f"/repos/{github_repo(repo_path)}/contents/.taskcluster.yml"
+    _cache.setdefault((endpoint, revision), content)
+
 
-async def get(repo_path, repo_type="hg", revision=None, default_branch=None):
+async def get(
+    repo_path, repo_type="hg", revision=None, default_branch=None, missing_ok=False
+):
     """
     Get `.taskcluster.yml` from 'default' (or the given revision) at the named
     repo_path.  Note that this does not parse the yml (so that it can be hashed
     in its original form).
 
-    If the file is not found, this returns None.
+    If the file is not found, this raises aiohttp.ClientResponseError, unless
+    `missing_ok` is set, in which case it returns None without retrying.
     """
     if repo_type == "hg":
         if revision is None:
@@ -33,47 +135,36 @@ async def get(repo_path, repo_type="hg", revision=None, default_branch=None):
             if cache_key in _cache:
                 return _cache[cache_key]
 
-            client = RetryClient(
-                client_session=aiohttp_session(),
-                # Despite only setting 404 here, 5xx statuses will still be retried
-                # for. See https://github.com/inyutin/aiohttp_retry?tab=readme-ov-file
-                # for details.
-                retry_options=ExponentialRetry(attempts=5, statuses={404}),
-            )
-            headers = {"User-Agent": USER_AGENT}
-            params = {}
-            async with client.get(url, headers=headers, params=params) as response:
-                try:
-                    response.raise_for_status()
-                    result = await response.read()
-                except aiohttp.ClientResponseError as e:
-                    print(f"Got error when querying {url}: {e}")
-                    raise e
+            fetcher = HgFetcher.get()
+            try:
+                # hg revisions are immutable, so the file at a given node can
+                # be cached indefinitely
+                node = await fetcher.resolve(repo_path, revision, missing_ok)
+                if node is None:
+                    return None
+                cache_file = f"{repo_path}/raw-file/{node}/.taskcluster.yml"
+                result = cache.load("hg-files", cache_file)
+                if result is None:
+                    result = await fetcher.read(cache_file, missing_ok=missing_ok)
+                    if result is None:
+                        return None
+                    cache.store("hg-files", cache_file, result)
+            except aiohttp.ClientResponseError as e:
+                print(f"Got error when querying {url}: {e}")
+                raise e
 
             _cache[cache_key] = result
 
     elif repo_type == "git":
         if revision is None:
             revision = default_branch or "master"
-        if repo_path.startswith("https://github.com/"):
-            if repo_path.endswith("/"):
-                repo_path = repo_path[:-1]
-            repo = repo_path.replace("https://github.com/", "")
-            endpoint = f"/repos/{repo}/contents/.taskcluster.yml"
-        elif repo_path.startswith("git@github.com:"):
-            if repo_path.endswith(".git"):
-                repo_path = repo_path[:-4]
-            repo = repo_path.replace("git@github.com:", "")
-            endpoint = f"/repos/{repo}/contents/.taskcluster.yml"
-        else:
-            raise Exception(
-                f"Don't know how to determine file URL for non-github repo: {repo_path}"
-            )
-
+        endpoint = f"/repos/{github_repo(repo_path)}/contents/.taskcluster.yml"
         cache_key = (endpoint, revision)
 
         async with _lock.setdefault(cache_key, Lock()):
-            if cache_key in _cache:
+            # a file primed as missing is only reported as such to callers
+            # which expect that; others fetch it, and so get the usual error
+            if cache_key in _cache and (_cache[cache_key] is not None or missing_ok):
                 return _cache[cache_key]
 
             headers = {"Accept": "application/vnd.github.raw+json"}
@@ -83,6 +174,8 @@ async def get(repo_path, repo_type="hg", revision=None, default_branch=None):
             response = await client.request(
                 "GET", endpoint, headers=headers, params=params
             )
+            if missing_ok and response.status == 404:
+                return None
             try:
                 response.raise_for_status()
                 result = await response.read()
@@ -2,16 +2,31 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file, You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
+import asyncio
 import copy
+import functools
 import hashlib
+import inspect
 import json
+import multiprocessing
 import re
+from concurrent.futures import ProcessPoolExecutor
 
 import attr
+from tcadmin.appconfig import AppConfig
 from tcadmin.resources import WorkerPool
 
-from ..util.keyed_by import evaluate_keyed_by, iter_dot_path, resolve_keyed_by
-from ..util.templates import merge
+from ..util import cache, canonical_json, keyed_by, templates
+from ..util.canonical_json import CanonicalJSON
+from ..util.keyed_by import (
+    KeyedByCache,
+    compile_keyed_by,
+    evaluate_keyed_by,
+    iter_dot_path,
+    resolve_keyed_by,
+)
+from ..util.orchestration import run_cpu_bound
+from ..util.templates import merge, merge_shared
 from .ciconfig.environment import Environment
 from .ciconfig.externally_managed import (
     manage_individual,
@@ -21,16 +36,10 @@ from .ciconfig.get import get_ciconfig_file
 from .ciconfig.worker_images import WorkerImage
 from .ciconfig.worker_pools import WorkerPool as ConfigWorkerPool
 
-
-def is_invalid_aws_instance_type(invalid_instances, zone, instance_type):
-    family, size = instance_type.split(".", 1)
-    return any(
-        (zone in entry["zones"]) and (family in entry["families"])
-        for entry in invalid_instances
-    )
+_MISSING = object()
 
 
-def is_invalid_gcp_instance_type(invalid_instances, zone, machine_type):
+def _parse_gcp_machine_type(machine_type):
     # Parse machine type: family-profile[-cpus[-suffix]]
     # e.g., "c4d-standard-8-lssd" -> family="c4d", suffix="lssd"
     parts = machine_type.split("-")
@@ -50,24 +59,103 @@ def is_invalid_gcp_instance_type(invalid_instances, zone, machine_type):
         # Note: we might eventually want to support multi suffixes (ie: highlssd-metal)
         #  where a config with -metal is also filtered out
         suffix = "-".join(parts[3:])
+    return family, profile, suffix
 
-    for entry in invalid_instances:
-        # Zones and Families are required and always needs to be a match. Suffixes are optional.
 
-        # True if suffixes undefined, or [], or actually matches config
-        matches_suffix = not entry.get("suffixes") or suffix in entry["suffixes"]
-        matches_profile = not entry.get("profiles") or profile in entry["profiles"]
+class InvalidInstances:
+    """
+    An index of an environment's `invalid-instances` list, keyed by zone and then
+    by family, so that checking an instance type does not scan the whole list.
 
-        if (
-            zone in entry["zones"]
-            and family in entry["families"]
-            and matches_suffix
-            and matches_profile
-        ):
-            # Invalid!
+    Each (zone, family) maps to the list of (profiles, suffixes) restrictions of
+    the entries naming it, where None means the entry applies to any profile or
+    suffix.  If any entry is unrestricted, the list is replaced by True.
+    """
+
+    __slots__ = ("_index", "_machine_types")
+
+    def __init__(self, invalid_instances):
+        index = {}
+        for entry in invalid_instances:
+            # Zones and Families are required and always needs to be a match.
+            # Suffixes and profiles are optional.
+            profiles = frozenset(entry["profiles"]) if entry.get("profiles") else None
+            suffixes = frozenset(entry["suffixes"]) if entry.get("suffixes") else None
+            for zone in entry["zones"]:
+                by_family = index.setdefault(zone, {})
+                for family in entry["families"]:
+                    rules = by_family.setdefault(family, [])
+                    if rules is True:
+                        continue
+                    if profiles is None and suffixes is None:
+                        by_family[family] = True
+                    else:
+                        rules.append((profiles, suffixes))
+        self._index = index
+        self._machine_types = {}
+
+    def is_invalid_aws(self, zone, instance_type):
+        family, size = instance_type.split(".", 1)
+        return family in self._index.get(zone, ())
+
+    def is_invalid_gcp(self, zone, machine_type):
+        try:
+            family, profile, suffix = self._machine_types[machine_type]
+        except KeyError:
+            family, profile, suffix = self._machine_types[machine_type] = (
+                _parse_gcp_machine_type(machine_type)
+            )
+        rules = self._index.get(zone, {}).get(family)
+        if rules is None:
+            return False
+        if rules is True:
             return True
-    # No matches found, machine_type is valid in this zone
-    return False
+        return any(
+            (profiles is None or profile in profiles)
+            and (suffixes is None or suffix in suffixes)
+            for profiles, suffixes in rules
+        )
+
+
+def get_invalid_instances(environment):
+    """
+    Build the InvalidInstances indexes for the environment's providers, keyed by
+    provider implementation.  This is done once per run, and the index passed
+    to each pool's provider.
+    """
+    return {
+        "aws": InvalidInstances(environment.aws_config.get("invalid-instances", [])),
+        "google": InvalidInstances(
+            environment.google_config.get("invalid-instances") or []
+        ),
+    }
+
+
+def is_invalid_aws_instance_type(invalid_instances, zone, instance_type):
+    return InvalidInstances(invalid_instances).is_invalid_aws(zone, instance_type)
+
+
+def is_invalid_gcp_instance_type(invalid_instances, zone, machine_type):
+    return InvalidInstances(invalid_instances).is_invalid_gcp(zone, machine_type)
+
+
+def _with_wst_server_url(worker_config, wst_server_url):
+    """
+    Return worker_config with `genericWorker.config.wstServerURL` defaulted to the
+    given URL.  Only the containers along that path are copied, as worker_config
+    may share its subtrees with other launch configs.
+    """
+    generic_worker = worker_config.get("genericWorker", {})
+    gw_config = generic_worker.get("config")
+    if not gw_config or "wstServerURL" in gw_config:
+        return worker_config
+    return {
+        **worker_config,
+        "genericWorker": {
+            **generic_worker,
+            "config": {**gw_config, "wstServerURL": wst_server_url},
+        },
+    }
 
 
 def _validate_instance_capacity(pool_id, implementation, instance_types):
@@ -95,16 +183,24 @@ def _validate_instance_capacity(pool_id, implementation, instance_types):
             )
 
 
-def _populate_launch_config_id(launch_config, pool_id):
-    launch_config_id = launch_config.get("workerManager", {}).get("launchConfigId")
-    if launch_config_id is not None:
+def _populate_launch_config_id(launch_config, pool_id, encoder=None):
+    """
+    Set `workerManager.launchConfigId` to a hash of the pool ID and the launch
+    config, unless it is already set.  Passing the same `encoder` for all
+    of a pool's launch configs avoids re-serializing their shared subtrees.
+    """
+    worker_manager = launch_config.get("workerManager", {})
+    if worker_manager.get("launchConfigId") is not None:
         return
-    hashedLaunchConfig = hashlib.sha256(
-        (pool_id + json.dumps(launch_config, sort_keys=True)).encode("utf8")
-    ).hexdigest()
-    launch_config.setdefault("workerManager", {})["launchConfigId"] = (
-        "lc-" + hashedLaunchConfig[:20]
-    )
+    if encoder is None:
+        encoder = CanonicalJSON()
+    hashedLaunchConfig = encoder.sha256(pool_id, launch_config)
+    # replace rather than update workerManager, as the encoder may have
+    # remembered its serialization
+    launch_config["workerManager"] = {
+        **worker_manager,
+        "launchConfigId": "lc-" + hashedLaunchConfig[:20],
+    }
 
 
 def _normalize_arm_parameters(parameters):
@@ -208,11 +304,11 @@ def _build_arm_template_launch_config(
 
     launch_config = {
         "location": loc,
-        "tags": merge(tags),
-        "workerConfig": merge(worker_config),
+        "tags": merge_shared(tags),
+        "workerConfig": merge_shared(worker_config),
         "armDeployment": arm_deployment,
         "armDeploymentResourceGroup": arm_resource_group,
-        "workerManager": merge(worker_manager_config),
+        "workerManager": merge_shared(worker_manager_config),
     }
 
     return launch_config
@@ -238,7 +334,15 @@ def _resolve_defaults(defaults, provider_id, implementation):
 
 
 def get_aws_provider_config(
-    environment, provider_id, pool_id, config, worker_images, defaults
+    environment,
+    provider_id,
+    pool_id,
+    config,
+    worker_images,
+    defaults,
+    *,
+    keyed_by_cache=None,
+    invalid_instances=None,
 ):
     regions = config.pop("regions")
     image = worker_images[config["image"]]
@@ -249,6 +353,8 @@ def get_aws_provider_config(
     implementation = config.pop("implementation", "docker-worker")
 
     aws_config = environment.aws_config
+    if keyed_by_cache is None:
+        keyed_by_cache = KeyedByCache()
 
     # Merge defaults with pool config.
     defaults = _resolve_defaults(defaults, provider_id, implementation)
@@ -263,28 +369,38 @@ def get_aws_provider_config(
 
     _validate_instance_capacity(pool_id, implementation, instance_types)
 
+    # These are evaluated for every region, zone and instance type, so compile
+    # them once up-front.
+    initial_weight_by = compile_keyed_by(
+        worker_manager_config.get("initialWeight", None)
+    )
+    max_capacity_by = compile_keyed_by(worker_manager_config.get("maxCapacity", None))
+    if invalid_instances is None:
+        invalid_instances = InvalidInstances(aws_config["invalid-instances"])
+
+    # launch configs share much of their structure, so serialize them for
+    # hashing with a single encoder
+    encoder = CanonicalJSON()
     launch_configs = []
     for region in sorted(regions):
-        availability_zones = evaluate_keyed_by(
+        availability_zones = keyed_by_cache.evaluate(
             aws_config["availability-zones"], pool_id, {"region": region}
         )
-        security_groups = evaluate_keyed_by(
+        security_groups = keyed_by_cache.evaluate(
             aws_config["security-groups"],
             pool_id,
             {"region": region, "security": security},
         )
         for availability_zone in sorted(availability_zones):
-            subnet_id = evaluate_keyed_by(
+            subnet_id = keyed_by_cache.evaluate(
                 aws_config["subnet-id"],
                 pool_id,
                 {"availability-zone": availability_zone},
             )
 
             for instance_type in sorted(instance_types):
-                if is_invalid_aws_instance_type(
-                    aws_config["invalid-instances"],
-                    availability_zone,
-                    instance_type["instanceType"],
+                if invalid_instances.is_invalid_aws(
+                    availability_zone, instance_type["instanceType"]
                 ):
                     continue
 
@@ -292,17 +408,9 @@ def get_aws_provider_config(
                     "availabilityZone": availability_zone,
                     "instanceType": instance_type["instanceType"],
                 }
-                initial_weight = evaluate_keyed_by(
-                    worker_manager_config.get("initialWeight", None),
-                    "initialWeight",
-                    attrs,
-                )
-                max_capacity = evaluate_keyed_by(
-                    worker_manager_config.get("maxCapacity", None),
-                    "maxCapacity",
-                    attrs,
-                )
-                instance_worker_manager_config = merge(
+                initial_weight = initial_weight_by.evaluate("initialWeight", attrs)
+                max_capacity = max_capacity_by.evaluate("maxCapacity", attrs)
+                instance_worker_manager_config = merge_shared(
                     {
                         "capacityPerInstance": instance_type.get(
                             "capacityPerInstance", 1
@@ -318,7 +426,7 @@ def get_aws_provider_config(
                     instance_type.get("worker-manager-config", {}),
                 )
                 if implementation == "docker-worker":
-                    instance_worker_config = merge(
+                    instance_worker_config = merge_shared(
                         worker_config,
                         instance_type.get("worker-config", {}),
                         {
@@ -328,15 +436,13 @@ def get_aws_provider_config(
                         },
                     )
                 else:
-                    instance_worker_config = merge(
+                    instance_worker_config = merge_shared(
                         worker_config,
                         instance_type.get("worker-config", {}),
                     )
-                    if aws_config.get("wst_server_url") and instance_worker_config.get(
-                        "genericWorker", {}
-                    ).get("config"):
-                        instance_worker_config["genericWorker"]["config"].setdefault(
-                            "wstServerURL", aws_config["wst_server_url"]
+                    if aws_config.get("wst_server_url"):
+                        instance_worker_config = _with_wst_server_url(
+                            instance_worker_config, aws_config["wst_server_url"]
                         )
                 image_id = image.get(provider_id, region)
                 launch_config = {
@@ -356,7 +462,7 @@ def get_aws_provider_config(
                 launch_config["additionalUserData"].update(
                     instance_type.get("additional-user-data", {})
                 )
-                launch_config["launchConfig"] = merge(
+                launch_config["launchConfig"] = merge_shared(
                     launch_config["launchConfig"], instance_type.get("launchConfig", {})
                 )
                 if spot:
@@ -364,7 +470,7 @@ def get_aws_provider_config(
                         "MarketType": "spot"
                     }
                 launch_config["launchConfig"].pop("capacityPerInstance", None)
-                _populate_launch_config_id(launch_config, pool_id)
+                _populate_launch_config_id(launch_config, pool_id, encoder)
                 launch_configs.append(launch_config)
 
     return {
@@ -377,7 +483,14 @@ def get_aws_provider_config(
 
 
 def get_azure_provider_config(
-    environment, provider_id, pool_id, config, worker_images, defaults
+    environment,
+    provider_id,
+    pool_id,
+    config,
+    worker_images,
+    defaults,
+    *,
+    keyed_by_cache=None,
 ):
     locations = config.pop("locations")
     vmSizes = config["vmSizes"]
@@ -387,6 +500,8 @@ def get_azure_provider_config(
         "implementation", "generic-worker/worker-runner-windows"
     )
     azure_config = environment.azure_config
+    if keyed_by_cache is None:
+        keyed_by_cache = KeyedByCache()
 
     # Merge defaults with pool config.
     defaults = _resolve_defaults(defaults, provider_id, implementation)
@@ -422,6 +537,26 @@ def get_azure_provider_config(
 
     tags = config.get("tags", {})
 
+    # Get publicIp from worker_manager_config or config, if defined
+    public_ip_source = None
+    if "publicIp" in worker_manager_config:
+        public_ip_source = worker_manager_config["publicIp"]
+    elif "publicIp" in config:
+        public_ip_source = config["publicIp"]
+
+    # These are evaluated for every location and vmSize, so compile them once
+    # up-front.
+    initial_weight_by = compile_keyed_by(
+        worker_manager_config.get("initialWeight", None)
+    )
+    max_capacity_by = compile_keyed_by(worker_manager_config.get("maxCapacity", None))
+    public_ip_by = compile_keyed_by(public_ip_source)
+    image_arm_deployment_by = compile_keyed_by(image.get(provider_id, "armDeployment"))
+    pool_arm_deployment_by = compile_keyed_by(config.get("armDeployment"))
+
+    # launch configs share much of their structure, so serialize them for
+    # hashing with a single encoder
+    encoder = CanonicalJSON()
     launch_configs = []
     for location in sorted(locations):
         for vmSize in vmSizes:
@@ -461,31 +596,14 @@ def get_azure_provider_config(
                 "vmSize": vmSize.get("vmSize"),
                 "pool-id": pool_id,
             }
-            initial_weight = evaluate_keyed_by(
-                worker_manager_config.get("initialWeight", None), "initialWeight", attrs
-            )
-            max_capacity = evaluate_keyed_by(
-                worker_manager_config.get("maxCapacity", None),
-                "maxCapacity",
-                attrs,
-            )
-
-            # Get publicIp from worker_manager_config or config, if defined
-            public_ip_source = None
-            if "publicIp" in worker_manager_config:
-                public_ip_source = worker_manager_config["publicIp"]
-            elif "publicIp" in config:
-                public_ip_source = config["publicIp"]
+            initial_weight = initial_weight_by.evaluate("initialWeight", attrs)
+            max_capacity = max_capacity_by.evaluate("maxCapacity", attrs)
 
             public_ip = None
             if public_ip_source is not None:
-                public_ip = evaluate_keyed_by(
-                    public_ip_source,
-                    "publicIp",
-                    attrs,
-                )
+                public_ip = public_ip_by.evaluate("publicIp", attrs)
 
-            instance_worker_manager_config = merge(
+            instance_worker_manager_config = merge_shared(
                 {"capacityPerInstance": vmSize.get("capacityPerInstance", 1)},
                 worker_manager_config,
                 {"initialWeight": initial_weight} if initial_weight is not None else {},
@@ -500,16 +618,13 @@ def get_azure_provider_config(
                 return evaluate_keyed_by(value, item_name, attrs)
 
             arm_layers = [
-                _evaluate_optional(
-                    azure_config.get("armDeployment"), "armDeployment.environment"
-                ),
-                _evaluate_optional(
-                    image.get(provider_id, "armDeployment"),
-                    "armDeployment.image",
-                ),
-                _evaluate_optional(
-                    config.get("armDeployment"), "armDeployment.pool-config"
+                keyed_by_cache.evaluate(
+                    azure_config.get("armDeployment"),
+                    "armDeployment.environment",
+                    attrs,
                 ),
+                image_arm_deployment_by.evaluate("armDeployment.image", attrs),
+                pool_arm_deployment_by.evaluate("armDeployment.pool-config", attrs),
                 _evaluate_optional(vmSize.get("armDeployment"), "armDeployment.vmSize"),
             ]
 
@@ -527,19 +642,15 @@ def get_azure_provider_config(
                 arm_layers=arm_layers,
             )
             if arm_launch_config:
-                _populate_launch_config_id(arm_launch_config, pool_id)
+                _populate_launch_config_id(arm_launch_config, pool_id, encoder)
                 launch_configs.append(arm_launch_config)
                 continue
 
             launch_config = {
                 "location": loc,
                 "subnetId": subnetId,
-                "tags": merge(
-                    tags,
-                ),
-                "workerConfig": merge(
-                    worker_config,
-                ),
+                "tags": merge_shared(tags),
+                "workerConfig": merge_shared(worker_config),
                 "hardwareProfile": {"vmSize": vmSize},
                 "priority": "spot",
                 "billingProfile": {"maxPrice": -1},
@@ -548,8 +659,8 @@ def get_azure_provider_config(
                 "workerManager": instance_worker_manager_config,
             }
 
-            launch_config = merge(launch_config, vmSize.get("launchConfig", {}))
-            _populate_launch_config_id(launch_config, pool_id)
+            launch_config = merge_shared(launch_config, vmSize.get("launchConfig", {}))
+            _populate_launch_config_id(launch_config, pool_id, encoder)
             launch_configs.append(launch_config)
 
     return {
@@ -562,13 +673,23 @@ def get_azure_provider_config(
 
 
 def get_google_provider_config(
-    environment, provider_id, pool_id, config, worker_images, defaults
+    environment,
+    provider_id,
+    pool_id,
+    config,
+    worker_images,
+    defaults,
+    *,
+    keyed_by_cache=None,
+    invalid_instances=None,
 ):
     regions = config.pop("regions")
     image = worker_images[config["image"]]
     instance_types = config["instance_types"]
     implementation = config.pop("implementation", "docker-worker")
     google_config = environment.google_config
+    if keyed_by_cache is None:
+        keyed_by_cache = KeyedByCache()
 
     # Merge defaults with pool config.
     defaults = _resolve_defaults(defaults, provider_id, implementation)
@@ -585,17 +706,29 @@ def get_google_provider_config(
 
     _validate_instance_capacity(pool_id, implementation, instance_types)
 
+    # These are evaluated for every region, zone and instance type, so compile
+    # them once up-front.
+    initial_weight_by = compile_keyed_by(
+        worker_manager_config.get("initialWeight", None)
+    )
+    max_capacity_by = compile_keyed_by(worker_manager_config.get("maxCapacity", None))
+    if invalid_instances is None:
+        invalid_instances = InvalidInstances(
+            google_config.get("invalid-instances") or []
+        )
+
+    # launch configs share much of their structure, so serialize them for
+    # hashing with a single encoder
+    encoder = CanonicalJSON()
     launch_configs = []
     for region in sorted(regions):
-        zones = evaluate_keyed_by(google_config["zones"], pool_id, {"region": region})
+        zones = keyed_by_cache.evaluate(
+            google_config["zones"], pool_id, {"region": region}
+        )
         for zone in sorted(zones):
             for instance_type in instance_types:
-                if google_config.get(
-                    "invalid-instances"
-                ) and is_invalid_gcp_instance_type(
-                    google_config["invalid-instances"],
-                    zone,
-                    instance_type["machine_type"],
+                if invalid_instances.is_invalid_gcp(
+                    zone, instance_type["machine_type"]
                 ):
                     continue
                 launch_config = copy.deepcopy(instance_type)
@@ -605,17 +738,9 @@ def get_google_provider_config(
                     "zone": zone,
                     "machineType": instance_type["machine_type"],
                 }
-                initial_weight = evaluate_keyed_by(
-                    worker_manager_config.get("initialWeight", None),
-                    "initialWeight",
-                    attrs,
-                )
-                max_capacity = evaluate_keyed_by(
-                    worker_manager_config.get("maxCapacity", None),
-                    "maxCapacity",
-                    attrs,
-                )
-                instance_worker_manager_config = merge(
+                initial_weight = initial_weight_by.evaluate("initialWeight", attrs)
+                max_capacity = max_capacity_by.evaluate("maxCapacity", attrs)
+                instance_worker_manager_config = merge_shared(
                     {
                         "capacityPerInstance": launch_config.pop(
                             "capacityPerInstance", 1
@@ -653,12 +778,12 @@ def get_google_provider_config(
                         disk["initializeParams"]["diskType"] = (
                             "zones/" + zone + "/" + yamlDefinedDiskType
                         )
-                launch_config["workerConfig"] = merge(
+                launch_config["workerConfig"] = merge_shared(
                     worker_config,
                     launch_config.pop("worker-config", {}),
                 )
                 if implementation == "docker-worker":
-                    launch_config["workerConfig"] = merge(
+                    launch_config["workerConfig"] = merge_shared(
                         launch_config["workerConfig"],
                         {
                             "capacity": instance_worker_manager_config.get(
@@ -667,12 +792,11 @@ def get_google_provider_config(
                         },
                     )
                 else:
-                    if google_config.get("wst_server_url") and launch_config[
-                        "workerConfig"
-                    ].get("genericWorker", {}).get("config"):
-                        launch_config["workerConfig"]["genericWorker"][
-                            "config"
-                        ].setdefault("wstServerURL", google_config["wst_server_url"])
+                    if google_config.get("wst_server_url"):
+                        launch_config["workerConfig"] = _with_wst_server_url(
+                            launch_config["workerConfig"],
+                            google_config["wst_server_url"],
+                        )
                 launch_config["machineType"] = (
                     f"zones/{zone}/machineTypes/{launch_config.pop('machine_type')}"
                 )
@@ -701,7 +825,7 @@ def get_google_provider_config(
                 scheduling_choice = launch_config.get("scheduling", "spot")
                 launch_config["scheduling"] = scheduling_options[scheduling_choice]
 
-                _populate_launch_config_id(launch_config, pool_id)
+                _populate_launch_config_id(launch_config, pool_id, encoder)
                 launch_configs.append(launch_config)
 
     return {
@@ -720,22 +844,177 @@ PROVIDER_IMPLEMENTATIONS = {
 }
 
 
-async def make_worker_pool(environment, resources, wp, worker_images, worker_defaults):
+def _make_pool_config(
+    environment,
+    wp,
+    worker_images,
+    worker_defaults,
+    *,
+    keyed_by_cache=None,
+    invalid_instances=None,
+):
     if wp.provider_id in environment.worker_manager["providers"]:
         provider_implementation = environment.worker_manager["providers"][
             wp.provider_id
         ]["implementation"]
-        config = PROVIDER_IMPLEMENTATIONS[provider_implementation](
+        kwargs = {"keyed_by_cache": keyed_by_cache}
+        if invalid_instances and provider_implementation in invalid_instances:
+            kwargs["invalid_instances"] = invalid_instances[provider_implementation]
+        return PROVIDER_IMPLEMENTATIONS[provider_implementation](
             environment,
             wp.provider_id,
             wp.pool_id,
             copy.deepcopy(wp.config),
             worker_images,
             worker_defaults,
+            **kwargs,
         )
     else:
-        config = wp.config
+        return wp.config
+
 
+@functools.cache
+def _generator_digest():
+    """
+    Hash the source of the modules that determine a pool's generated config, so
+    that changing the generator invalidates previously cached configs.
+    """
+    digest = hashlib.sha256()
+    sources = [module.__file__ for module in (canonical_json, keyed_by, templates)]
+    # the ciconfig classes whose attributes are part of the fingerprints
+    sources.extend(inspect.getsourcefile(cls) for cls in (Environment, WorkerImage))
+    sources.append(__file__)
+    for source in sources:
+        with open(source, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _shared_fingerprint(environment, worker_defaults):
+    """
+    Hash the inputs common to all pools: the generator itself, the environment
+    and `worker-defaults`.  Returns None if the inputs can't be hashed stably.
+    """
+    try:
+        return hashlib.sha256(
+            json.dumps(
+                [_generator_digest(), attr.asdict(environment), worker_defaults],
+                sort_keys=True,
+            ).encode("utf8")
+        ).hexdigest()
+    except TypeError:
+        return None
+
+
+def _pool_fingerprint(shared_fingerprint, wp, worker_images):
+    """
+    Hash everything a pool's generated config depends on: its fully-expanded
+    variant config, the worker image it uses and the shared inputs.  Returns None
+    if the inputs can't be hashed stably (for example, mixed-type keys).
+    """
+    if shared_fingerprint is None:
+        return None
+    image = None
+    if isinstance(wp.config, dict) and isinstance(wp.config.get("image"), str):
+        image = worker_images.get(wp.config["image"])
+    try:
+        return hashlib.sha256(
+            json.dumps(
+                [
+                    shared_fingerprint,
+                    wp.pool_id,
+                    wp.provider_id,
+                    wp.config,
+                    attr.asdict(image) if image else None,
+                ],
+                sort_keys=True,
+            ).encode("utf8")
+        ).hexdigest()
+    except TypeError:
+        return None
+
+
+def _make_pool_configs(environment, wps, worker_images, worker_defaults):
+    """
+    Generate the configs for the given pool variants, in order.  This is the
+    unit of work given to each process when generating in parallel, so it must
+    only take and return picklable values.
+
+    Generated configs are cached on disk, keyed by a fingerprint of their
+    inputs, so only pools whose inputs changed since a previous run are
+    regenerated.
+    """
+    # Environment-level keyed-by values (zones, subnets, security groups, ..)
+    # are shared by all pools, so evaluate each only once per set of relevant
+    # attributes.
+    keyed_by_cache = KeyedByCache()
+    invalid_instances = get_invalid_instances(environment)
+    shared_fingerprint = _shared_fingerprint(environment, worker_defaults)
+
+    configs = []
+    for wp in wps:
+        fingerprint = _pool_fingerprint(shared_fingerprint, wp, worker_images)
+        config = _MISSING
+        if fingerprint:
+            config = cache.load("worker-pools", fingerprint, _MISSING)
+        if config is _MISSING:
+            config = _make_pool_config(
+                environment,
+                wp,
+                worker_images,
+                copy.deepcopy(worker_defaults),
+                keyed_by_cache=keyed_by_cache,
+                invalid_instances=invalid_instances,
+            )
+            if fingerprint:
+                cache.store("worker-pools", fingerprint, config)
+        configs.append(config)
+    return configs
+
+
+def _init_worker(cache_enabled, cache_dir):
+    "Apply the parent's cache settings in a worker process"
+    cache.enabled = cache_enabled
+    cache.CACHE_DIR = cache_dir
+
+
+async def _make_pool_configs_in_parallel(
+    environment, wps, worker_images, worker_defaults, jobs
+):
+    """
+    Like `_make_pool_configs`, but sharding the pools over `jobs` processes.  The
+    shards are contiguous and gathered in order, so the result is identical.
+    """
+    shard_size = -(-len(wps) // jobs)
+    shards = [wps[i : i + shard_size] for i in range(0, len(wps), shard_size)]
+
+    loop = asyncio.get_running_loop()
+    # Start workers with "spawn", as forking a process with running threads
+    # (aiohttp's resolver, run_cpu_bound) can deadlock.  Spawned workers do not
+    # inherit module state, so pass along the cache settings.
+    with ProcessPoolExecutor(
+        max_workers=len(shards),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(cache.enabled, cache.CACHE_DIR),
+    ) as executor:
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    executor,
+                    _make_pool_configs,
+                    environment,
+                    shard,
+                    worker_images,
+                    worker_defaults,
+                )
+                for shard in shards
+            )
+        )
+    return [config for shard in results for config in shard]
+
+
+def _make_worker_pool_resource(wp, config):
     return WorkerPool(
         workerPoolId=wp.pool_id,
         description=wp.description,
@@ -746,6 +1025,15 @@ async def make_worker_pool(environment, resources, wp, worker_images, worker_def
     )
 
 
+async def make_worker_pool(
+    environment, resources, wp, worker_images, worker_defaults, *, keyed_by_cache=None
+):
+    config = _make_pool_config(
+        environment, wp, worker_images, worker_defaults, keyed_by_cache=keyed_by_cache
+    )
+    return _make_worker_pool_resource(wp, config)
+
+
 def generate_pool_variants(worker_pools, environment):
     """
     Generate the list of worker pools by evaluting them at all the specified
@@ -895,13 +1183,21 @@ async def update_resources(resources):
     )
     environment = await Environment.current()
 
-    for wp in generate_pool_variants(worker_pools, environment):
+    wps = list(generate_pool_variants(worker_pools, environment))
+    for wp in wps:
         # For pools in externally-managed namespaces, explicitly manage
         # the individual resources we generate
         manage_individual(resources, f"WorkerPool={wp.pool_id}")
 
-        apwt = await make_worker_pool(
-            environment, resources, wp, worker_images, copy.deepcopy(worker_defaults)
+    jobs = int(AppConfig.current().options.get("--jobs") or 1)
+    if jobs > 1 and len(wps) > 1:
+        configs = await _make_pool_configs_in_parallel(
+            environment, wps, worker_images, worker_defaults, jobs
         )
-        if apwt:
-            resources.add(apwt)
+    else:
+        configs = await run_cpu_bound(
+            _make_pool_configs, environment, wps, worker_images, worker_defaults
+        )
+
+    for wp, config in zip(wps, configs):
+        resources.add(_make_worker_pool_resource(wp, config))
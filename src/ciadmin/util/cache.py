@@ -0,0 +1,69 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+
+# Root of the on-disk cache, unless overridden.
+CACHE_DIR = os.environ.get(
+    "CIADMIN_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".mozbuild", "ci-admin", "cache"),
+)
+
+# Set CIADMIN_NO_CACHE to any value to bypass the on-disk cache entirely.
+enabled = not os.environ.get("CIADMIN_NO_CACHE")
+
+# The number of `load` hits and misses, keyed by (namespace, "hits" or
+# "misses"); see ciadmin.util.profiling
+stats = collections.Counter()
+
+
+def _path(namespace, key):
+    digest = hashlib.sha256(key.encode("utf8")).hexdigest()
+    return os.path.join(CACHE_DIR, namespace, digest[:2], digest)
+
+
+def load(namespace, key, default=None):
+    """
+    Return the value stored under `key` in `namespace`, or `default` if there is
+    no such entry.  Unreadable or corrupt entries are treated as misses.
+    """
+    if not enabled:
+        return default
+    try:
+        with open(_path(namespace, key), "rb") as f:
+            value = pickle.load(f)
+    except Exception:
+        stats[namespace, "misses"] += 1
+        return default
+    stats[namespace, "hits"] += 1
+    return value
+
+
+def store(namespace, key, value):
+    """
+    Store `value` under `key` in `namespace`.  The write is atomic, so concurrent
+    ci-admin processes never observe a partial entry.  Failures to write (for
+    example, a read-only home directory) are ignored, as the cache is only an
+    optimization.
+    """
+    if not enabled:
+        return
+    path = _path(namespace, key)
+    dirname = os.path.dirname(path)
+    try:
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=dirname)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError:
+        pass
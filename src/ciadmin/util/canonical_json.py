@@ -0,0 +1,85 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import json
+from json.encoder import encode_basestring_ascii
+
+
+class CanonicalJSON:
+    """
+    Serialize values exactly as `json.dumps(value, sort_keys=True)` would,
+    remembering the serialization of every nested dict and list.
+
+    Launch configs for a pool share most of their subtrees (see
+    `templates.merge_shared`), so serializing them with a single instance only
+    does the work for each shared subtree once.  Containers are remembered by
+    identity, so values passed to one instance must not be modified after they
+    have been serialized.  The top-level value itself is never remembered, so
+    it may be modified freely (for example, to record its own hash).
+    """
+
+    __slots__ = ("_memo",)
+
+    def __init__(self):
+        # id(container) -> (container, text); holding a reference to the
+        # container ensures its id is not reused while the memo is alive
+        self._memo = {}
+
+    def dumps(self, value):
+        if isinstance(value, dict):
+            return self._dumps_dict(value)
+        if isinstance(value, (list, tuple)):
+            return self._dumps_list(value)
+        return self._dumps_scalar(value)
+
+    def sha256(self, prefix, value):
+        """
+        Return the hex sha256 of `prefix` followed by the canonical
+        serialization of `value`.
+        """
+        return hashlib.sha256((prefix + self.dumps(value)).encode("utf8")).hexdigest()
+
+    def _dumps_nested(self, value):
+        if isinstance(value, str):
+            return encode_basestring_ascii(value)
+        if isinstance(value, (dict, list, tuple)):
+            hit = self._memo.get(id(value))
+            if hit is not None:
+                return hit[1]
+            if isinstance(value, dict):
+                text = self._dumps_dict(value)
+            else:
+                text = self._dumps_list(value)
+            self._memo[id(value)] = (value, text)
+            return text
+        return self._dumps_scalar(value)
+
+    def _dumps_dict(self, value):
+        if not value:
+            return "{}"
+        if not all(isinstance(k, str) for k in value):
+            # leave non-string keys (and their coercion rules) to json
+            return json.dumps(value, sort_keys=True)
+        nested = self._dumps_nested
+        return (
+            "{"
+            + ", ".join(
+                f"{encode_basestring_ascii(k)}: {nested(value[k])}"
+                for k in sorted(value)
+            )
+            + "}"
+        )
+
+    def _dumps_list(self, value):
+        if not value:
+            return "[]"
+        nested = self._dumps_nested
+        return "[" + ", ".join(nested(v) for v in value) + "]"
+
+    @staticmethod
+    def _dumps_scalar(value):
+        if isinstance(value, str):
+            return encode_basestring_ascii(value)
+        return json.dumps(value)
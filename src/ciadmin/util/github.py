@@ -3,9 +3,19 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 
 import asyncio
+import hashlib
+import json
+import os
 
+import click
+from gql.transport.exceptions import TransportQueryError
 from simple_github import AsyncClient, client_from_env
 
+from . import cache
+
+# The number of repositories (or files) to request in a single GraphQL query.
+GRAPHQL_BATCH_SIZE = 20
+
 # Global shared client session
 _client: AsyncClient | None = None
 _client_lock = asyncio.Lock()
@@ -36,3 +46,210 @@ async def close_client():
         if _client is not None:
             await _client.close()
             _client = None
+
+
+def graphql_available():
+    """GitHub's GraphQL API is only available to authenticated clients."""
+    return bool(
+        os.environ.get("GITHUB_TOKEN")
+        or (os.environ.get("GITHUB_APP_ID") and os.environ.get("GITHUB_APP_PRIVKEY"))
+    )
+
+
+def _repository(repo):
+    "GraphQL arguments selecting the repository with the given `owner/name`"
+    owner, name = repo.split("/", 1)
+    return f"repository(owner: {json.dumps(owner)}, name: {json.dumps(name)})"
+
+
+def _batches(items):
+    for i in range(0, len(items), GRAPHQL_BATCH_SIZE):
+        yield items[i : i + GRAPHQL_BATCH_SIZE]
+
+
+async def _execute(client, query, description):
+    """
+    Execute a GraphQL query, returning its data, or None if it failed.
+
+    If only some of the query's fields fail (for example, a repository that
+    does not exist or is not accessible), GitHub reports errors for those and
+    still answers the others.  The data is returned with null for each field
+    that failed, so that only those fall back to the REST API.
+    """
+    try:
+        return await client.execute(query)
+    except TransportQueryError as e:
+        if e.data:
+            click.echo(f"Falling back to REST for some {description}: {e}", err=True)
+            return e.data
+        error = e
+    except Exception as e:
+        error = e
+    click.echo(f"Falling back to REST for {description}: {error}", err=True)
+    return None
+
+
+async def get_branches_bulk(repos):
+    """
+    Get the branches of each of the given `owner/name` repositories using
+    batched GraphQL queries.  Returns {repo: [branch names]}, in the same
+    (alphabetical) order as the REST API.  Repositories which could not be
+    queried are omitted, so that the caller can fall back to the REST API.
+    """
+    client = await get_client()
+    branches = {repo: [] for repo in repos}
+    cursors = {repo: None for repo in repos}
+    failed = set()
+
+    while cursors:
+        batch = list(cursors)[:GRAPHQL_BATCH_SIZE]
+        query = "query {\n"
+        for i, repo in enumerate(batch):
+            after = json.dumps(cursors[repo])
+            query += (
+                f"  r{i}: {_repository(repo)} {{\n"
+                f'    refs(refPrefix: "refs/heads/", first: 100, after: {after}, '
+                "orderBy: {field: ALPHABETICAL, direction: ASC}) {\n"
+                "      pageInfo { hasNextPage endCursor }\n"
+                "      nodes { name }\n"
+                "    }\n"
+                "  }\n"
+            )
+        query += "}\n"
+
+        result = await _execute(client, query, f"branches of {', '.join(batch)}")
+        if result is None:
+            failed.update(batch)
+            for repo in batch:
+                del cursors[repo]
+            continue
+
+        for i, repo in enumerate(batch):
+            repository = result.get(f"r{i}")
+            if not repository or not repository.get("refs"):
+                failed.add(repo)
+                del cursors[repo]
+                continue
+            refs = repository["refs"]
+            branches[repo].extend(node["name"] for node in refs["nodes"])
+            if refs["pageInfo"]["hasNextPage"]:
+                cursors[repo] = refs["pageInfo"]["endCursor"]
+            else:
+                del cursors[repo]
+
+    return {repo: names for repo, names in branches.items() if repo not in failed}
+
+
+def _git_blob_sha(content):
+    "The git object ID of a blob with the given content"
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+async def _execute_batches(queries, description):
+    """
+    Execute the given GraphQL query fields (keyed by alias) in batches, returning
+    {alias: result}.  Aliases in failed batches are omitted, and those which
+    failed individually are None.
+    """
+    client = await get_client()
+    results = {}
+    for batch in _batches(list(queries.items())):
+        query = "query {\n" + "".join(field for _, field in batch) + "}\n"
+        result = await _execute(client, query, f"{len(batch)} {description}")
+        if result is not None:
+            results.update(result)
+    return results
+
+
+async def get_blob_oids_bulk(requests, path):
+    """
+    Get the git blob ID of the file at `path` for each of the given (`owner/name`
+    repository, ref) pairs using batched GraphQL queries.  This is much cheaper
+    than fetching the files' contents.  Returns {(repo, ref): oid}, with an oid
+    of None where `path` does not exist.  Pairs which could not be queried, or
+    where `path` is not a file (such as a directory), are omitted, so that the
+    caller can fall back to the REST API.
+    """
+    requests = list(requests)
+    queries = {}
+    for i, (repo, ref) in enumerate(requests):
+        expression = json.dumps(f"{ref}:{path}")
+        queries[f"f{i}"] = (
+            f"  f{i}: {_repository(repo)} {{\n"
+            f"    object(expression: {expression}) {{ ... on Blob {{ oid }} }}\n"
+            "  }\n"
+        )
+    results = await _execute_batches(queries, f"copies of {path}")
+
+    oids = {}
+    for i, key in enumerate(requests):
+        repository = results.get(f"f{i}")
+        if repository is None:
+            continue
+        blob = repository.get("object")
+        if blob is None:
+            oids[key] = None
+        # a directory is an object without the Blob's fields
+        elif "oid" in blob:
+            oids[key] = blob["oid"]
+    return oids
+
+
+async def get_files_bulk(requests, path):
+    """
+    Get the contents of the file at `path` for each of the given (`owner/name`
+    repository, ref) pairs.  Returns {(repo, ref): bytes}, or None for pairs
+    where the file does not exist.
+
+    This first resolves each file's git blob ID, then downloads each distinct
+    blob only once, keeping it in a content-addressed store on disk so that it
+    is never downloaded again.  Pairs sharing a blob share the same bytes object.
+    Pairs which could not be queried (see `get_blob_oids_bulk`), or whose
+    content GraphQL cannot return intact (binary or truncated files), are
+    omitted, so that the caller can fall back to the REST API.
+    """
+    oids = await get_blob_oids_bulk(requests, path)
+
+    blobs = {}
+    # {oid: a repository containing it}, for blobs not yet in the store
+    to_fetch = {}
+    for (repo, _), oid in oids.items():
+        if oid is None or oid in blobs or oid in to_fetch:
+            continue
+        content = cache.load("git-blobs", oid)
+        if content is not None:
+            blobs[oid] = content
+        else:
+            to_fetch[oid] = repo
+
+    queries = {
+        f"b{i}": (
+            f"  b{i}: {_repository(repo)} {{\n"
+            f"    object(oid: {json.dumps(oid)}) {{\n"
+            "      ... on Blob { text isBinary isTruncated }\n"
+            "    }\n"
+            "  }\n"
+        )
+        for i, (oid, repo) in enumerate(to_fetch.items())
+    }
+    results = await _execute_batches(queries, f"blobs of {path}")
+    for i, oid in enumerate(to_fetch):
+        blob = (results.get(f"b{i}") or {}).get("object")
+        if not blob or blob.get("text") is None:
+            continue
+        if blob.get("isBinary") or blob.get("isTruncated"):
+            continue
+        content = blob["text"].encode("utf-8")
+        # only trust the text if it round-trips to the original bytes
+        if _git_blob_sha(content) != oid:
+            continue
+        cache.store("git-blobs", oid, content)
+        blobs[oid] = content
+
+    contents = {}
+    for key, oid in oids.items():
+        if oid is None:
+            contents[key] = None
+        elif oid in blobs:
+            contents[key] = blobs[oid]
+    return contents
@@ -190,3 +190,182 @@ def evaluate_keyed_by(value, item_name, attributes):
         raise Exception(
             f"No {keyed_by} matching {key!r} nor 'default' found while determining item {item_name}"
         )
+
+
+def _is_keyed_by(value):
+    return (
+        isinstance(value, dict)
+        and len(value) == 1
+        and isinstance(next(iter(value)), str)
+        and next(iter(value)).startswith("by-")
+    )
+
+
+class KeyedBy:
+    """
+    A keyed-by value compiled for repeated evaluation.
+
+    `evaluate_keyed_by` walks the `by-*` structure and compiles a regular
+    expression for every alternative each time it is called.  When the same
+    value is evaluated many times against different attributes (for example,
+    once per region, zone and instance type of a worker pool), compile it once
+    with `compile_keyed_by` and call `evaluate` instead.  The result, including
+    any error raised, is the same as calling `evaluate_keyed_by` with the
+    original value.
+    """
+
+    __slots__ = ("value", "keyed_by", "alternatives", "patterns", "default", "fields")
+
+    def __init__(self, value):
+        self.value = value
+        self.keyed_by = None
+        # The (sorted) attributes this value, including nested alternatives,
+        # depends on
+        self.fields = ()
+        if not _is_keyed_by(value):
+            return
+
+        by_key, alternatives = next(iter(value.items()))
+        self.keyed_by = by_key[3:]  # strip off 'by-' prefix
+        self.alternatives = {k: KeyedBy(v) for k, v in alternatives.items()}
+        self.fields = tuple(
+            sorted(
+                {self.keyed_by}.union(*(v.fields for v in self.alternatives.values()))
+            )
+        )
+        self.patterns = []
+        for k, v in self.alternatives.items():
+            try:
+                pattern = re.compile(k + "$")
+            except (TypeError, re.error):
+                # Defer the error until a lookup actually needs this pattern,
+                # as `keymatch` would.
+                pattern = None
+            self.patterns.append((k, pattern, v))
+        self.default = self.alternatives.get("default")
+
+    def _match(self, key):
+        # exact match
+        if key in self.alternatives:
+            return [self.alternatives[key]]
+
+        # regular expression match
+        matches = [
+            v
+            for k, pattern, v in self.patterns
+            if (pattern.match(key) if pattern else re.match(k + "$", key))
+        ]
+        if matches:
+            return matches
+
+        # default
+        if self.default is not None:
+            return [self.default]
+
+        return []
+
+    def evaluate(self, item_name, attributes):
+        """
+        Evaluate this value for the given attributes; see `evaluate_keyed_by`.
+        """
+        compiled = self
+        while compiled.keyed_by is not None:
+            keyed_by = compiled.keyed_by
+            key = attributes.get(keyed_by)
+
+            if len(compiled.alternatives) == 1 and compiled.default is not None:
+                # Error out when only 'default' is specified as only alternatives,
+                # because we don't need to by-{keyed_by} there.
+                raise Exception(
+                    f"Keyed-by '{keyed_by}' unnecessary with only value 'default' "
+                    f"found, when determining item {item_name}"
+                )
+
+            if key is None:
+                if compiled.default is not None:
+                    compiled = compiled.default
+                    continue
+                else:
+                    raise Exception(
+                        f"No attribute {keyed_by} and no value for 'default' found "
+                        f"while determining item {item_name}"
+                    )
+
+            matches = compiled._match(key)
+            if len(matches) > 1:
+                raise Exception(
+                    f"Multiple matching values for {keyed_by} {key!r} found while "
+                    f"determining item {item_name}"
+                )
+            elif matches:
+                compiled = matches[0]
+                continue
+
+            raise Exception(
+                f"No {keyed_by} matching {key!r} nor 'default' found while determining item {item_name}"
+            )
+
+        return compiled.value
+
+
+def compile_keyed_by(value):
+    """
+    Compile a value which may be keyed-by some attributes into a `KeyedBy`
+    object, which can be evaluated repeatedly and cheaply.
+    """
+    return KeyedBy(value)
+
+
+class KeyedByCache:
+    """
+    Memoize keyed-by evaluation over the course of one generation run.
+
+    The result of evaluating a keyed-by value depends only on the attributes
+    named by its `by-*` keys, so results are cached on those attribute values
+    alone.  For example, a value keyed only by region is evaluated once per
+    region, however many pools (with otherwise different attributes) ask for it.
+
+    Values are tracked by identity, so this must only be used for values that
+    are not modified during the run, such as environment configuration.
+    """
+
+    def __init__(self):
+        self._compiled = {}
+        self._results = {}
+
+    def compile(self, value):
+        "Return the `KeyedBy` for this value, compiling it on first use"
+        try:
+            held, compiled = self._compiled[id(value)]
+            if held is value:
+                return compiled
+        except KeyError:
+            pass
+        compiled = KeyedBy(value)
+        # hold a reference to value, so that its id is not reused
+        self._compiled[id(value)] = (value, compiled)
+        return compiled
+
+    def evaluate(self, value, item_name, attributes):
+        """
+        Equivalent to `evaluate_keyed_by(value, item_name, attributes)`.
+        Errors are not cached, so they always name the requested item.
+        """
+        if not _is_keyed_by(value):
+            return value
+
+        compiled = self.compile(value)
+        # Include the type, so that for example `1` and `True` are not conflated.
+        key = (id(value),) + tuple(
+            (type(v), v) for v in (attributes.get(f) for f in compiled.fields)
+        )
+        try:
+            return self._results[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable attribute values can't be cached
+            return compiled.evaluate(item_name, attributes)
+
+        result = self._results[key] = compiled.evaluate(item_name, attributes)
+        return result
@@ -137,6 +137,86 @@ def project_match(grantee, project):
     return True
 
 
+class ProjectIndex:
+    """
+    An index of projects by the attributes that `project_match` considers, so that
+    the projects matching a grantee can be found by set intersection rather than
+    by checking every project.
+
+    `matching(grantee)` returns the same projects, in the same order, as filtering
+    the original list with `project_match`.
+    """
+
+    def __init__(self, projects):
+        self.projects = list(projects)
+        self._all = frozenset(range(len(self.projects)))
+        self._access = {}
+        self._repo_type = {}
+        self._alias = {}
+        self._trust_domain = {}
+        self._is_try = {}
+        self._has_trust_project = {}
+        self._feature = {}
+        # level only applies to projects with `access`; others match any level
+        self._level = {}
+        self._no_access = set()
+
+        for i, project in enumerate(self.projects):
+            self._access.setdefault(project.access, set()).add(i)
+            self._repo_type.setdefault(project.repo_type, set()).add(i)
+            self._alias.setdefault(project.alias, set()).add(i)
+            self._trust_domain.setdefault(project.trust_domain, set()).add(i)
+            self._is_try.setdefault(project.is_try, set()).add(i)
+            has_trust_project = bool(project.trust_project)
+            self._has_trust_project.setdefault(has_trust_project, set()).add(i)
+            for feature in project.features:
+                if project.feature(feature):
+                    self._feature.setdefault(feature, set()).add(i)
+            if project.access:
+                self._level.setdefault(project.default_branch_level, set()).add(i)
+            else:
+                self._no_access.add(i)
+
+    @staticmethod
+    def _lookup(index, grantee_values):
+        "The projects whose value in `index` is any of `grantee_values`"
+        result = set()
+        for value in grantee_values:
+            result.update(index.get(value, ()))
+        return result
+
+    def matching(self, grantee):
+        "Return the projects matching the given ProjectGrantee"
+        candidates = self._all
+        if grantee.access is not None:
+            candidates = candidates & self._lookup(self._access, grantee.access)
+        if grantee.repo_type is not None:
+            candidates = candidates & self._lookup(self._repo_type, grantee.repo_type)
+        if grantee.level is not None:
+            candidates = candidates & (
+                self._lookup(self._level, grantee.level) | self._no_access
+            )
+        if grantee.alias is not None:
+            candidates = candidates & self._lookup(self._alias, grantee.alias)
+        if grantee.feature is not None:
+            for feature in grantee.feature:
+                if feature.startswith("!"):
+                    candidates = candidates - self._feature.get(feature[1:], set())
+                else:
+                    candidates = candidates & self._feature.get(feature, set())
+        if grantee.is_try is not None:
+            candidates = candidates & self._is_try.get(grantee.is_try, set())
+        if grantee.has_trust_project is not None:
+            candidates = candidates & self._has_trust_project.get(
+                grantee.has_trust_project, set()
+            )
+        if grantee.trust_domain is not None:
+            candidates = candidates & self._lookup(
+                self._trust_domain, grantee.trust_domain
+            )
+        return [self.projects[i] for i in sorted(candidates)]
+
+
 def branch_match(grantee, branch):
     if not match(grantee.level, branch.level):
         return False
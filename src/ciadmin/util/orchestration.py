@@ -0,0 +1,109 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+import re
+
+from tcadmin.appconfig import CallablesRegistry
+from tcadmin.resources import Resources
+from tcadmin.util.matchlist import MatchList
+
+# GeneratorRegistry and the classes below override or rely on these parts of
+# tc-admin, which are not part of its public interface; test_util_orchestration
+# checks that they still behave as expected:
+#  - tcadmin.generate.resources calls `generators._call_all(resources)`
+#  - CallablesRegistry.filter returns a registry with a `callables` list
+#  - Resources.add and Resources.update check `is_managed`, and then call
+#    `_verify`, which checks every resource
+#  - iterating a MatchList yields Match(include, excludes) entries
+
+# Whether run_cpu_bound runs its function in a thread.  The profiler turns this
+# off, as it runs generators one at a time anyway and cProfile only sees the
+# event loop's thread.
+offload_cpu = True
+
+
+async def run_cpu_bound(fn, *args):
+    """
+    Call fn(*args) in a thread, so that the event loop can carry on with other
+    generators' requests meanwhile.  `fn` must not use the click context (such
+    as `AppConfig.current().options`), which is local to the loop's thread.
+    """
+    if not offload_cpu:
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+
+class _GeneratedResources(Resources):
+    """
+    Resources for a single generator, whose managed patterns are not checked
+    until the resources are merged (see GeneratorRegistry).  Checking each
+    resource against all of the patterns every time one is added makes
+    generating N resources cost O(N^2) regex matches.
+    """
+
+    def is_managed(self, id):
+        return True
+
+    def _verify(self):
+        pass
+
+
+class _MatchList(MatchList):
+    """
+    A MatchList which compiles each pattern only once.  MatchList.matches
+    relies on the `re` module's cache, which holds far fewer patterns than a
+    full set of resources manages, and so recompiles almost every pattern for
+    every resource.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # pattern -> compiled regex
+        self._compiled = {}
+
+    def _compile(self, pattern):
+        try:
+            return self._compiled[pattern]
+        except KeyError:
+            compiled = self._compiled[pattern] = re.compile(pattern)
+            return compiled
+
+    def matches(self, item):
+        return any(
+            self._compile(entry.include).match(item)
+            and not any(
+                self._compile(exclude).match(item) for exclude in entry.excludes
+            )
+            for entry in self
+        )
+
+
+async def _generate(generator):
+    generated = _GeneratedResources()
+    await generator(generated)
+    return generated
+
+
+class GeneratorRegistry(CallablesRegistry):
+    """
+    A registry of resource generators which runs them concurrently, each into
+    its own Resources, and then merges those into the final Resources in
+    registration order.  The result does not depend on which generator
+    finishes first, and generators do not pay to verify each other's resources
+    as they add their own.
+    """
+
+    def filter(self, names):
+        rv = GeneratorRegistry(self.name)
+        rv.callables = super().filter(names).callables
+        return rv
+
+    async def _call_all(self, resources):
+        results = await asyncio.gather(*(_generate(c) for c in self))
+        resources.managed = _MatchList(list(resources.managed))
+        for generated in results:
+            resources.managed.extend(generated.managed)
+        for generated in results:
+            resources.update(generated)
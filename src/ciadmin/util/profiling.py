@@ -0,0 +1,145 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+import collections
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import resource
+import sys
+import time
+
+import aiohttp
+from yarl import URL
+
+from ciadmin.util import cache
+
+# The name of the generator making the current HTTP request, if it is being
+# profiled.  Tasks started by a generator inherit this.
+_generator = contextvars.ContextVar("ciadmin_profiled_generator", default=None)
+
+# generator name -> Counter of HTTP requests by host
+_http_requests = collections.defaultdict(collections.Counter)
+
+
+def _count_http_requests():
+    """
+    Count every request made with an aiohttp session (taskcluster, GitHub, and
+    hg alike) against the generator making it.  aiohttp has no global hook for
+    this (trace configs are per-session, and the sessions are created by
+    libraries), so this wraps ClientSession._request, through which all
+    requests pass.
+    """
+    request = aiohttp.ClientSession._request
+    if getattr(request, "_ciadmin_profiling", False):
+        return
+
+    @functools.wraps(request)
+    async def _request(session, method, str_or_url, *args, **kwargs):
+        name = _generator.get()
+        if name is not None:
+            url = URL(str_or_url)
+            base_url = getattr(session, "_base_url", None)
+            if not url.is_absolute() and base_url is not None:
+                url = base_url.join(url)
+            _http_requests[name][url.host or ""] += 1
+        return await request(session, method, str_or_url, *args, **kwargs)
+
+    _request._ciadmin_profiling = True
+    aiohttp.ClientSession._request = _request
+
+
+def _max_rss():
+    "The peak resident set size of this process so far, in bytes"
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _cache_report(stats):
+    "Summarize a Counter of cache.stats by namespace"
+    report = {}
+    for namespace in sorted({namespace for namespace, _ in stats}):
+        hits = stats[namespace, "hits"]
+        misses = stats[namespace, "misses"]
+        report[namespace] = {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 3),
+        }
+    return report
+
+
+class Profiler:
+    """
+    Record the wall time, CPU time, peak memory, HTTP requests by host and
+    local cache hit rates of each wrapped resource generator, writing them as a
+    JSON report to `path`.  If `cprofile` is set, a cProfile dump for each
+    generator is written alongside the report, named `<report>.<name>.prof`.
+
+    Generators usually run concurrently; wrapped generators instead run one at
+    a time, so that these measurements can be attributed to each.  Peak memory
+    is the process's peak resident set size when the generator completes, and
+    `max_rss_increase` how much of that peak it added.  Work done in
+    subprocesses (such as worker pool generation with `--jobs`) is not
+    included in CPU time or memory.
+    """
+
+    def __init__(self, path, cprofile=False):
+        self.path = path
+        self.cprofile = cprofile
+        self.report = {}
+        self._lock = asyncio.Lock()
+
+    def wrap(self, name, generator):
+        "Return a profiled version of the given generator, recorded as `name`"
+        _count_http_requests()
+
+        @functools.wraps(generator)
+        async def wrapper(resources):
+            async with self._lock:
+                return await self._run(name, generator, resources)
+
+        return wrapper
+
+    async def _run(self, name, generator, resources):
+        token = _generator.set(name)
+        _http_requests.pop(name, None)
+        cache_stats = cache.stats.copy()
+        profile = cProfile.Profile() if self.cprofile else None
+        max_rss_start = _max_rss()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profile:
+            profile.enable()
+        try:
+            return await generator(resources)
+        finally:
+            if profile:
+                profile.disable()
+            cpu_time = time.process_time() - cpu_start
+            wall_time = time.perf_counter() - wall_start
+            max_rss = _max_rss()
+            _generator.reset(token)
+            self.report[name] = {
+                "wall_time": round(wall_time, 3),
+                "cpu_time": round(cpu_time, 3),
+                "max_rss": max_rss,
+                "max_rss_increase": max_rss - max_rss_start,
+                "http_requests": dict(_http_requests[name]),
+                "cache": _cache_report(cache.stats - cache_stats),
+            }
+            if profile:
+                profile.dump_stats(f"{os.path.splitext(self.path)[0]}.{name}.prof")
+            # write the report as each generator completes, as tc-admin exits
+            # once it is done with the generated resources
+            self.write()
+
+    def write(self):
+        with open(self.path, "w") as f:
+            json.dump(self.report, f, indent=2, sort_keys=True)
+            f.write("\n")
@@ -0,0 +1,77 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import bisect
+
+
+class ScopeSet:
+    """
+    A set of scopes which is kept normalized as scopes are added, so that
+    `normalized()` returns the same list as `tcadmin.util.scopes.normalizeScopes`
+    would for all of the scopes added, without comparing every pair of scopes.
+
+    Duplicates are ignored, and scopes satisfied by a star scope (other than
+    themselves) are dropped as soon as both are present.
+    """
+
+    __slots__ = ("_seen", "_scopes", "_star_prefixes", "_star_prefix_lengths")
+
+    def __init__(self, scopes=()):
+        # every scope ever added
+        self._seen = set()
+        # sorted scopes not satisfied by any other scope
+        self._scopes = []
+        # the prefixes of all star scopes ever added (without the trailing `*`),
+        # and the distinct lengths of those prefixes
+        self._star_prefixes = set()
+        self._star_prefix_lengths = []
+        self.update(scopes)
+
+    def _satisfied(self, scope):
+        "Is this scope satisfied by a star scope other than itself?"
+        for length in self._star_prefix_lengths:
+            if length > len(scope):
+                break
+            prefix = scope[:length]
+            if prefix in self._star_prefixes and prefix + "*" != scope:
+                return True
+        return False
+
+    def add(self, scope):
+        if scope in self._seen:
+            return
+        self._seen.add(scope)
+
+        if scope.endswith("*"):
+            prefix = scope[:-1]
+            self._star_prefixes.add(prefix)
+            i = bisect.bisect_left(self._star_prefix_lengths, len(prefix))
+            if i == len(self._star_prefix_lengths) or (
+                self._star_prefix_lengths[i] != len(prefix)
+            ):
+                self._star_prefix_lengths.insert(i, len(prefix))
+
+            # drop the scopes this one satisfies; they sort together, just after
+            # the prefix
+            start = end = bisect.bisect_left(self._scopes, prefix)
+            while end < len(self._scopes) and self._scopes[end].startswith(prefix):
+                end += 1
+            del self._scopes[start:end]
+
+        if not self._satisfied(scope):
+            bisect.insort(self._scopes, scope)
+
+    def update(self, scopes):
+        for scope in scopes:
+            self.add(scope)
+
+    def __iter__(self):
+        return iter(self._scopes)
+
+    def __len__(self):
+        return len(self._scopes)
+
+    def normalized(self):
+        "Return the normalized, sorted list of scopes"
+        return list(self._scopes)
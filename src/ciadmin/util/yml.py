@@ -0,0 +1,22 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import yaml
+
+# Prefer the libyaml-backed loader, which is several times faster than the
+# pure-Python one.  Both construct each anchored node once and hand out that
+# same object for every alias, so callers relying on (or defending against)
+# aliases being shared see identical behavior either way.
+try:
+    from yaml import CSafeLoader as Loader
+except ImportError:
+    from yaml import SafeLoader as Loader
+
+
+def safe_load(stream):
+    """
+    Parse a YAML document from a str or bytes, like `yaml.safe_load`, using the
+    fastest available safe loader.
+    """
+    return yaml.load(stream, Loader=Loader)
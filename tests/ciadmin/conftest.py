@@ -9,6 +9,19 @@ from tcadmin.appconfig import AppConfig
 
 from ciadmin.generate.ciconfig import get
 from ciadmin.generate.ciconfig.projects import Project
+from ciadmin.util import cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """
+    Point the on-disk cache at a per-test directory, so tests neither read nor
+    pollute the developer's cache.
+    """
+    path = tmp_path / "ciadmin-cache"
+    monkeypatch.setattr(cache, "CACHE_DIR", str(path))
+    monkeypatch.setattr(cache, "enabled", True)
+    return path
 
 
 @pytest.fixture
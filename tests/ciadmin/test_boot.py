@@ -0,0 +1,57 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import subprocess
+import sys
+
+import pytest
+
+from ciadmin import boot
+
+
+def import_times(module):
+    """
+    Import `module` in a fresh interpreter with `-X importtime`, returning the
+    cumulative import time in microseconds of every module imported.
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize("resource", sorted(boot.RESOURCES))
+def test_get_generator(resource):
+    generator = boot.get_generator(resource)
+    assert generator.__name__ == "update_resources"
+    assert generator.__module__ == boot.RESOURCES[resource]
+
+
+def test_boot_import_time(record_property):
+    "Importing ciadmin.boot does not import any of the generators"
+    times = import_times("ciadmin.boot")
+    record_property("ciadmin.boot import time (us)", times["ciadmin.boot"])
+    assert not set(boot.RESOURCES.values()) & set(times)
+
+
+def test_help_lists_options():
+    "ci-admin's own options are listed in the subcommands' --help"
+    proc = subprocess.run(
+        [sys.executable, "-c", "from ciadmin.boot import boot; boot()"]
+        + ["generate", "--help"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for option in ("--resources TEXT", "--profile TEXT", "--no-cache", "--cprofile"):
+        assert f"  {option} " in proc.stdout
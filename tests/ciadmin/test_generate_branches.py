@@ -74,3 +74,79 @@ async def test_get_403_saml_enforcement(capsys):
     captured = capsys.readouterr()
     assert "403" in captured.out
     assert "SAML enforcement" in captured.out
+
+
+def make_response(status, body=None, headers=None):
+    response = MagicMock()
+    response.ok = status < 400
+    response.status = status
+    response.json = AsyncMock(return_value=body)
+    response.headers = headers or {}
+    return response
+
+
+@pytest.mark.asyncio
+async def test_get_revalidates_cached_pages():
+    branches_module._cache.clear()
+    next_link = (
+        '<https://api.github.com/repos/org/repo/branches?page=2>; rel="next", '
+        '<https://api.github.com/repos/org/repo/branches?page=2>; rel="last"'
+    )
+    client = make_mock_client(None)
+    client.request.side_effect = [
+        make_response(200, [{"name": "main"}], {"etag": '"page1"', "link": next_link}),
+        make_response(200, [{"name": "dev"}], {"etag": '"page2"'}),
+    ]
+
+    with patch(
+        "ciadmin.generate.branches.github.get_client", AsyncMock(return_value=client)
+    ):
+        assert await branches_module.get("org/repo") == ["main", "dev"]
+        assert client.request.call_args_list[0].kwargs["headers"] == {}
+
+        # a later run revalidates each page, reusing those that are unchanged
+        branches_module._cache.clear()
+        client.request.reset_mock()
+        client.request.side_effect = [
+            make_response(304),
+            make_response(200, [{"name": "dev"}, {"name": "new"}], {"etag": '"p2"'}),
+        ]
+        assert await branches_module.get("org/repo") == ["main", "dev", "new"]
+
+    first, second = client.request.call_args_list
+    assert first.args == ("GET", "/repos/org/repo/branches")
+    assert first.kwargs["headers"] == {"If-None-Match": '"page1"'}
+    assert second.args == ("GET", "/repos/org/repo/branches?page=2")
+    assert second.kwargs["headers"] == {"If-None-Match": '"page2"'}
+
+
+@pytest.mark.asyncio
+async def test_get_refetches_full_last_page(monkeypatch):
+    "A new branch after a full last page is not hidden by a 304 for that page"
+    branches_module._cache.clear()
+    monkeypatch.setattr(branches_module, "PER_PAGE", 2)
+    next_link = (
+        '<https://api.github.com/repos/org/repo/branches?page=2>; rel="next", '
+        '<https://api.github.com/repos/org/repo/branches?page=2>; rel="last"'
+    )
+    page = [{"name": "a"}, {"name": "b"}]
+    client = make_mock_client(None)
+    client.request.side_effect = [make_response(200, page, {"etag": '"page1"'})]
+
+    with patch(
+        "ciadmin.generate.branches.github.get_client", AsyncMock(return_value=client)
+    ):
+        assert await branches_module.get("org/repo") == ["a", "b"]
+
+        # a new branch "c" is on a new second page; the first is unchanged
+        branches_module._cache.clear()
+        client.request.reset_mock()
+        client.request.side_effect = [
+            make_response(200, page, {"etag": '"page1"', "link": next_link}),
+            make_response(200, [{"name": "c"}], {"etag": '"page2"'}),
+        ]
+        assert await branches_module.get("org/repo") == ["a", "b", "c"]
+
+    first, second = client.request.call_args_list
+    assert first.kwargs["headers"] == {}
+    assert second.args == ("GET", "/repos/org/repo/branches?page=2")
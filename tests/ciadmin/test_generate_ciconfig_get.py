@@ -160,3 +160,37 @@ async def test_get_ciconfig_dir_empty_files():
 
         with pytest.raises(ValueError, match="No valid data loaded"):
             await get_ciconfig_dir(tmpdir)
+
+
+@pytest.mark.asyncio
+@with_aiohttp_session
+async def test_get_yml_uses_disk_cache(mocker):
+    """Test that a second parse of the same content is served from the disk cache"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = os.path.join(tmpdir, "file.yml")
+        with open(file_path, "w") as f:
+            f.write("key: &anchor [1, 2]\nother: *anchor\n")
+
+        first = await _read_file(file_path)
+        safe_load = mocker.patch("ciadmin.util.yml.safe_load")
+        second = await _read_file(file_path)
+
+        assert safe_load.call_count == 0
+        assert second == first == {"key": [1, 2], "other": [1, 2]}
+        # aliases still refer to the same object, as they would from yaml
+        assert second["key"] is second["other"]
+
+
+@pytest.mark.asyncio
+@with_aiohttp_session
+async def test_get_yml_disk_cache_invalidated_on_change():
+    """Test that editing a file invalidates its cached parse"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file_path = os.path.join(tmpdir, "file.yml")
+        with open(file_path, "w") as f:
+            f.write("key: 1\n")
+        assert await _read_file(file_path) == {"key": 1}
+
+        with open(file_path, "w") as f:
+            f.write("key: 2\n")
+        assert await _read_file(file_path) == {"key": 2}
@@ -4,7 +4,7 @@
 
 import pytest
 
-from ciadmin.generate.ciconfig.grants import Grant
+from ciadmin.generate.ciconfig.grants import Grant, ScopeTemplate
 from ciadmin.util.matching import GroupGrantee, ProjectGrantee
 
 
@@ -174,3 +174,47 @@ async def test_fetch_from_grants_dir(mock_ciconfig_file):
     assert len(grants) == 2
     assert grants[0].scopes == ["scope1"]
     assert grants[1].scopes == ["scope2"]
+
+
+SUBS = {"alias": "proj", "level": 3, "priority": "highest", "trust_domain": "gecko"}
+
+
+@pytest.mark.parametrize(
+    "scope,fields",
+    [
+        ("plain:scope", set()),
+        ("escaped:{{braces}}", set()),
+        ("assume:repo:{alias}:*", {"alias"}),
+        ("{trust_domain}:level:{level}:{alias}:{priority}", SUBS.keys()),
+        ("escaped:{{{alias}}}", {"alias"}),
+        # these are left to str.format
+        ("spec:{level:03d}", set()),
+        ("conversion:{alias!r}", set()),
+        ("index:{alias[0]}", set()),
+    ],
+)
+def test_scope_template_render(scope, fields):
+    template = ScopeTemplate(scope)
+    assert template.fields == set(fields)
+    assert template.render(SUBS) == scope.format(**SUBS)
+
+
+@pytest.mark.parametrize("scope", ["unknown:{bar}", "positional:{}", "level:{level}"])
+def test_scope_template_missing_substitution(scope):
+    with pytest.raises((KeyError, IndexError)) as exc:
+        scope.format(alias="proj")
+    with pytest.raises(exc.type):
+        ScopeTemplate(scope).render({"alias": "proj"})
+
+
+def test_scope_template_malformed():
+    "Malformed scopes only fail when rendered"
+    template = ScopeTemplate("broken:{alias")
+    with pytest.raises(ValueError):
+        template.render(SUBS)
+
+
+def test_grant_scope_templates():
+    grant = Grant(scopes=["a:{alias}", "b"])
+    assert [t.scope for t in grant.scope_templates] == ["a:{alias}", "b"]
+    assert grant == Grant(scopes=["a:{alias}", "b"])
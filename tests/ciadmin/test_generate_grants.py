@@ -10,7 +10,7 @@ from tcadmin.resources import Resources
 from ciadmin.generate import grants
 from ciadmin.generate.ciconfig.grants import Grant
 from ciadmin.generate.ciconfig.projects import Project
-from ciadmin.util.matching import GroupGrantee, ProjectGrantee
+from ciadmin.util.matching import GroupGrantee, ProjectGrantee, ProjectIndex
 
 
 @pytest.fixture
@@ -71,7 +71,10 @@ class TestAddScopesForProjects:
         "If no projects match, it does not add scopes"
         grantee = ProjectGrantee(level=2)
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         assert add_scope.added == set()
 
@@ -79,7 +82,10 @@ class TestAddScopesForProjects:
         "If a projects matches, but no scopes are granted, nothing happens"
         grantee = ProjectGrantee(level=1)
         grants.add_scopes_for_projects(
-            Grant(scopes=[], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=[], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         assert add_scope.added == set()
 
@@ -87,7 +93,10 @@ class TestAddScopesForProjects:
         "If access matches, it adds scopes"
         grantee = ProjectGrantee(access="scm_nss")
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         assert add_scope.added == set(
             [
@@ -100,7 +109,10 @@ class TestAddScopesForProjects:
         "If levels match, it adds scopes"
         grantee = ProjectGrantee(level=1)
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         assert add_scope.added == set([("repo:hg.mozilla.org/foo/proj1:*", "sc")])
 
@@ -108,7 +120,10 @@ class TestAddScopesForProjects:
         "If levels match (with multiple options) it adds scopes"
         grantee = ProjectGrantee(level=[1, 2])
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         assert add_scope.added == set([("repo:hg.mozilla.org/foo/proj1:*", "sc")])
 
@@ -116,7 +131,10 @@ class TestAddScopesForProjects:
         "If alias matches it adds scopes"
         grantee = ProjectGrantee(alias="proj1")
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         assert add_scope.added == set(
             [
@@ -129,7 +147,10 @@ class TestAddScopesForProjects:
         "If feature matches it adds scopes"
         grantee = ProjectGrantee(feature="travis-ci")
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         assert add_scope.added == set(
             [
@@ -142,7 +163,10 @@ class TestAddScopesForProjects:
         "If !feature matches it adds scopes"
         grantee = ProjectGrantee(feature="!travis-ci")
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         assert add_scope.added == set(
             [
@@ -157,7 +181,10 @@ class TestAddScopesForProjects:
         "If is_try matches and is false it adds scopes"
         grantee = ProjectGrantee(is_try=False)
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         assert add_scope.added == set(
             [
@@ -172,7 +199,10 @@ class TestAddScopesForProjects:
         "If is_try matches and is true it adds scopes"
         grantee = ProjectGrantee(is_try=True)
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         assert add_scope.added == set(
             [
@@ -185,7 +215,10 @@ class TestAddScopesForProjects:
         "If trust_domain matches it adds scopes"
         grantee = ProjectGrantee(trust_domain="gecko")
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         assert add_scope.added == set(
             [
@@ -198,7 +231,10 @@ class TestAddScopesForProjects:
         "If has_trust_project matches and is true it adds scopes"
         grantee = ProjectGrantee(has_trust_project=True)
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         assert add_scope.added == set(
             [
@@ -217,7 +253,7 @@ class TestAddScopesForProjects:
             Grant(scopes=["sc"], grantees=grantees),
             grantees[0],
             add_scope,
-            self.projects,
+            ProjectIndex(self.projects),
         )
         assert add_scope.added == set(
             [
@@ -238,7 +274,7 @@ class TestAddScopesForProjects:
             ),
             grantee,
             add_scope,
-            self.projects,
+            ProjectIndex(self.projects),
         )
         assert add_scope.added == set(
             [
@@ -256,7 +292,7 @@ class TestAddScopesForProjects:
                 Grant(scopes=["foo:{bar}"], grantees=[grantee]),
                 grantee,
                 add_scope,
-                self.projects,
+                ProjectIndex(self.projects),
             )
 
     def test_scope_substitution_no_level(self, add_scope):
@@ -283,14 +319,14 @@ class TestAddScopesForProjects:
                 Grant(scopes=["foo:{level}"], grantees=[grantee]),
                 grantee,
                 add_scope,
-                projects,
+                ProjectIndex(projects),
             )
         with pytest.raises(KeyError):
             grants.add_scopes_for_projects(
                 Grant(scopes=["foo:{priority}"], grantees=[grantee]),
                 grantee,
                 add_scope,
-                projects,
+                ProjectIndex(projects),
             )
 
     def test_match_level_with_no_access_l3(self, add_scope):
@@ -324,7 +360,7 @@ class TestAddScopesForProjects:
             Grant(scopes=["sc"], grantees=[grantee]),
             grantee,
             add_scope,
-            projects,
+            ProjectIndex(projects),
         )
         # Without access field, project matches and grants to both branch and non-branch jobs
         assert add_scope.added == set(
@@ -365,7 +401,7 @@ class TestAddScopesForProjects:
             Grant(scopes=["sc"], grantees=[grantee]),
             grantee,
             add_scope,
-            projects,
+            ProjectIndex(projects),
         )
         # Without access field, project matches and grants to both branch and non-branch jobs
         assert add_scope.added == set(
@@ -375,6 +411,33 @@ class TestAddScopesForProjects:
             ]
         )
 
+    def test_grant_scopes_substitutions_per_run(self, monkeypatch):
+        "Project substitutions are computed once per project in each run"
+        calls = []
+        project_substitutions = grants.project_substitutions
+
+        def counting(project):
+            calls.append(project.alias)
+            return project_substitutions(project)
+
+        monkeypatch.setattr(grants, "project_substitutions", counting)
+        grantee = ProjectGrantee(alias="proj1")
+        grant_list = [
+            Grant(scopes=["a:{alias}"], grantees=[grantee]),
+            Grant(scopes=["b:{alias}:{level}"], grantees=[grantee]),
+        ]
+        environment = type("Environment", (), {"name": "test"})
+
+        for _ in range(2):
+            roles = grants.grant_scopes(
+                grant_list, ProjectIndex(self.projects), environment
+            )
+        assert calls == ["proj1", "proj1"]
+        assert sorted(roles["repo:hg.mozilla.org/foo/proj1:*"]) == [
+            "a:proj1",
+            "b:proj1:1",
+        ]
+
 
 class TestAddScopesForGroups:
     "Tests for add_scopes_to_groups"
@@ -489,7 +552,10 @@ class TestAddScopesForGithubPullRequest:
     def test_grant_to_pull_request_trusted(self, add_scope):
         grantee = ProjectGrantee(job=["pull-request:trusted"])
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         # Dump expected for copy/paste.
         pprint(add_scope.added)
@@ -503,7 +569,10 @@ class TestAddScopesForGithubPullRequest:
     def test_grant_to_pull_request_untrusted(self, add_scope):
         grantee = ProjectGrantee(job=["pull-request:untrusted"])
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         # Dump expected for copy/paste.
         pprint(add_scope.added)
@@ -520,7 +589,10 @@ class TestAddScopesForGithubPullRequest:
     def test_grant_to_pull_request_star(self, add_scope):
         grantee = ProjectGrantee(job=["pull-request:*"])
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         # Dump expected for copy/paste.
         pprint(add_scope.added)
@@ -539,7 +611,10 @@ class TestAddScopesForGithubPullRequest:
     def test_grant_to_star(self, add_scope):
         grantee = ProjectGrantee(job=["*"])
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         pr_grants = set([g for g in add_scope.added if "pull-request" in g[0]])
 
@@ -560,7 +635,10 @@ class TestAddScopesForGithubPullRequest:
     def test_include_pull_requests_false(self, add_scope):
         grantee = ProjectGrantee(job=["pull-request:*"], include_pull_requests=False)
         grants.add_scopes_for_projects(
-            Grant(scopes=["sc"], grantees=[grantee]), grantee, add_scope, self.projects
+            Grant(scopes=["sc"], grantees=[grantee]),
+            grantee,
+            add_scope,
+            ProjectIndex(self.projects),
         )
         assert add_scope.added == set()
 
@@ -571,7 +649,7 @@ class TestAddScopesForGithubPullRequest:
                 Grant(scopes=["sc"], grantees=[grantee]),
                 grantee,
                 add_scope,
-                self.projects,
+                ProjectIndex(self.projects),
             )
 
 
@@ -582,7 +660,7 @@ class TestAddScopesForGithubPush:
             Grant(scopes=["sc-{level}"], grantees=[grantee]),
             grantee,
             add_scope,
-            sample_projects,
+            ProjectIndex(sample_projects),
         )
         pprint(add_scope.added)
         assert add_scope.added == set(
@@ -600,7 +678,7 @@ class TestAddScopesForGithubPush:
             Grant(scopes=["sc"], grantees=[grantee]),
             grantee,
             add_scope,
-            sample_projects,
+            ProjectIndex(sample_projects),
         )
         pprint(add_scope.added)
         assert add_scope.added == set(
@@ -615,7 +693,7 @@ class TestAddScopesForGithubPush:
             Grant(scopes=["sc"], grantees=[grantee]),
             grantee,
             add_scope,
-            sample_projects,
+            ProjectIndex(sample_projects),
         )
         pprint(add_scope.added)
         assert add_scope.added == set(
@@ -634,7 +712,7 @@ class TestAddScopesForGithubPush:
             Grant(scopes=["sc"], grantees=[grantee]),
             grantee,
             add_scope,
-            sample_projects,
+            ProjectIndex(sample_projects),
         )
         pprint(add_scope.added)
         assert add_scope.added == set(
@@ -649,7 +727,7 @@ class TestAddScopesForGithubPush:
             Grant(scopes=["sc-{level}"], grantees=[grantee]),
             grantee,
             add_scope,
-            sample_projects,
+            ProjectIndex(sample_projects),
         )
         pprint(add_scope.added)
         assert add_scope.added == set(
@@ -667,7 +745,7 @@ class TestAddScopesForGithubPush:
             Grant(scopes=["sc"], grantees=[grantee]),
             grantee,
             add_scope,
-            sample_projects,
+            ProjectIndex(sample_projects),
         )
         pprint(add_scope.added)
         assert add_scope.added == set(
@@ -685,7 +763,7 @@ class TestAddScopesForGithubPush:
             Grant(scopes=["sc"], grantees=[grantee]),
             grantee,
             add_scope,
-            sample_projects,
+            ProjectIndex(sample_projects),
         )
         assert add_scope.added == set()
 
@@ -698,7 +776,7 @@ class TestAddScopesForGithubPush:
             Grant(scopes=["sc"], grantees=[grantee]),
             grantee,
             add_scope,
-            sample_projects,
+            ProjectIndex(sample_projects),
         )
         pprint(add_scope.added)
         assert add_scope.added == set(
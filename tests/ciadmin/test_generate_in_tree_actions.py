@@ -0,0 +1,255 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+from unittest.mock import AsyncMock
+
+import click
+import pytest
+from taskcluster.exceptions import TaskclusterRestFailure
+from tcadmin.appconfig import AppConfig
+
+from ciadmin.generate import in_tree_actions
+from ciadmin.generate.ciconfig.actions import Action
+from ciadmin.generate.ciconfig.projects import Project
+
+
+class FakeHooks:
+    options = {"rootUrl": "https://tc.example.com"}
+
+    def __init__(self, failures=None):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = []
+        # {hookId: [exception, ..]} of failures to raise before succeeding
+        self.failures = failures or {}
+
+    async def getHookStatus(self, hookGroupId, hookId):
+        self.calls.append(hookId)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0)
+            if self.failures.get(hookId):
+                raise self.failures[hookId].pop(0)
+            return {"hookId": hookId}
+        finally:
+            self.in_flight -= 1
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(mocker):
+    sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        await sleep(0)
+
+    mocker.patch.object(in_tree_actions.asyncio, "sleep", fake_sleep)
+
+
+@pytest.mark.asyncio
+async def test_get_hook_statuses_concurrency():
+    hooks = FakeHooks()
+    hook_ids = [("project-gecko", f"in-tree-action-{i}") for i in range(25)]
+    statuses = await in_tree_actions.get_hook_statuses(hooks, hook_ids, 4)
+    assert list(statuses) == hook_ids
+    assert statuses["project-gecko", "in-tree-action-3"] == {
+        "hookId": "in-tree-action-3"
+    }
+    assert hooks.max_in_flight == 4
+
+
+@pytest.mark.asyncio
+async def test_get_hook_statuses_retries_timeouts():
+    hooks = FakeHooks(failures={"a": [TimeoutError(), TimeoutError()]})
+    statuses = await in_tree_actions.get_hook_statuses(hooks, [("g", "a")])
+    assert statuses == {("g", "a"): {"hookId": "a"}}
+    assert hooks.calls == ["a", "a", "a"]
+
+
+@pytest.mark.asyncio
+async def test_get_hook_statuses_gives_up():
+    hooks = FakeHooks(failures={"a": [TimeoutError()] * 4})
+    with pytest.raises(asyncio.TimeoutError):
+        await in_tree_actions.get_hook_statuses(hooks, [("g", "a")])
+    assert len(hooks.calls) == in_tree_actions.HOOK_STATUS_ATTEMPTS
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status_code", [404, 500])
+async def test_get_hook_statuses_no_retry_client_failures(status_code):
+    "Failures the client raises, having retried them if it should, are not retried"
+    hooks = FakeHooks(
+        failures={"a": [TaskclusterRestFailure("failed", None, status_code)]}
+    )
+    with pytest.raises(TaskclusterRestFailure):
+        await in_tree_actions.get_hook_statuses(hooks, [("g", "a")])
+    assert hooks.calls == ["a"]
+
+
+@pytest.mark.asyncio
+async def test_get_hook_statuses_snapshot(mocker):
+    time = mocker.patch.object(in_tree_actions.time, "time", return_value=1000.0)
+    hooks = FakeHooks()
+    await in_tree_actions.get_hook_statuses(hooks, [("g", "a"), ("g", "b")], ttl=60)
+    assert hooks.calls == ["a", "b"]
+
+    # within the TTL, only hooks missing from the snapshot are fetched
+    time.return_value = 1030.0
+    statuses = await in_tree_actions.get_hook_statuses(
+        hooks, [("g", "a"), ("g", "c"), ("g", "b")], ttl=60
+    )
+    assert hooks.calls == ["a", "b", "c"]
+    assert list(statuses) == [("g", "a"), ("g", "c"), ("g", "b")]
+    assert statuses["g", "a"] == {"hookId": "a"}
+
+    # after the TTL, entries are fetched again
+    time.return_value = 1070.0
+    await in_tree_actions.get_hook_statuses(
+        hooks, [("g", "a"), ("g", "b"), ("g", "c")], ttl=60
+    )
+    assert hooks.calls == ["a", "b", "c", "a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_get_hook_statuses_no_snapshot():
+    hooks = FakeHooks()
+    await in_tree_actions.get_hook_statuses(hooks, [("g", "a")], ttl=60)
+    await in_tree_actions.get_hook_statuses(hooks, [("g", "a")])
+    await in_tree_actions.get_hook_statuses(hooks, [("g", "a")], ttl=0)
+    assert hooks.calls == ["a", "a", "a"]
+
+
+@pytest.mark.parametrize(
+    "command, ttl_option, expected",
+    [
+        ("diff", None, 0),
+        ("diff", "3600", 3600),
+        ("check", "60", 60),
+        ("apply", "3600", 0),
+    ],
+)
+def test_hook_status_ttl(command, ttl_option, expected):
+    "The snapshot is off by default, and never used by `apply`"
+    config = AppConfig()
+    config.options = {"--hook-status-ttl": ttl_option}
+    with AppConfig._as_current(config), click.Context(click.Command(command)):
+        assert in_tree_actions.hook_status_ttl() == expected
+
+
+@pytest.mark.asyncio
+async def test_tcyml_index(mocker):
+    projects = [
+        Project(
+            alias="central",
+            repo="https://hg.mozilla.org/mozilla-central",
+            repo_type="hg",
+            access="scm_level_3",
+            trust_domain="gecko",
+            features={"gecko-actions": True, "hg-push": True},
+        ),
+        Project(
+            alias="mobile",
+            repo="https://github.com/mozilla-mobile/mobile",
+            repo_type="git",
+            branches=[
+                {"name": "main", "level": 3},
+                {"name": "beta", "level": 3},
+                {"name": "dev", "level": 1},
+            ],
+            trust_domain="mobile",
+            features={"taskgraph-actions": True},
+        ),
+        Project(
+            alias="another",
+            repo="https://github.com/mozilla-mobile/another",
+            repo_type="git",
+            branches=[{"name": "main", "level": 1}],
+            trust_domain="mobile",
+            features={"taskgraph-actions": True},
+        ),
+    ]
+
+    def tcyml(alias, level, hash):
+        return {"parsed": {"hash": hash}, "hash": hash, "level": level, "alias": alias}
+
+    hashed_tcymls = {
+        "central": {"default": tcyml("central", 3, "hg")},
+        "mobile": {
+            "dev": tcyml("mobile", 1, "h1"),
+            "beta": tcyml("mobile", 3, "h2"),
+            "main": tcyml("mobile", 3, "h1"),
+        },
+        "another": {"main": tcyml("another", 1, "h3")},
+    }
+
+    async def get_project_branches(project):
+        if project.repo_type == "hg":
+            return ["default"]
+        return ["main", "beta", "dev", "no-tcyml"]
+
+    mocker.patch.object(in_tree_actions, "get_project_branches", get_project_branches)
+    index = await in_tree_actions.TcymlIndex.build(hashed_tcymls, projects)
+
+    hooks = index.hooks_for("mobile", 1)
+    assert list(hooks) == ["h1", "h2", "h3"]
+    assert hooks["h1"] == {"hash": "h1"}
+    assert list(index.hooks_for("mobile", 3)) == ["h1", "h2"]
+    assert list(index.hooks_for("gecko", 1)) == ["hg"]
+    assert index.hooks_for("comm", 1) == {}
+
+    assert index.matching_projects(3, "h1") == ["mobile, branch: 'main'"]
+    assert index.matching_projects(1, "h1") == ["mobile, branch: 'dev'"]
+    assert index.matching_projects(1, "h2") == []
+
+    action = Action(trust_domain="mobile", level=3, action_perm="generic")
+    with AppConfig._as_current(AppConfig()):
+        hook = in_tree_actions.make_hook(action, {"tasks": [{}]}, "h1", index)
+    assert hook.hookId == "in-tree-action-3-generic/h1"
+    assert "mobile, branch: 'main'\n" in hook.description
+
+
+@pytest.mark.asyncio
+async def test_prefetch_github_tcymls(mocker, monkeypatch):
+    monkeypatch.setenv("GITHUB_TOKEN", "token")
+    monkeypatch.setattr(in_tree_actions.branches, "_cache", {})
+    monkeypatch.setattr(in_tree_actions.tcyml, "_cache", {})
+    project = Project(
+        alias="app",
+        repo="https://github.com/org/app",
+        repo_type="git",
+        branches=[{"name": "main", "level": 3}, {"name": "release-*", "level": 3}],
+        trust_domain="app",
+        features={"taskgraph-actions": True},
+    )
+    get_branches_bulk = mocker.patch.object(
+        in_tree_actions.github,
+        "get_branches_bulk",
+        AsyncMock(return_value={"org/app": ["dev", "main", "release-1"]}),
+    )
+    get_files_bulk = mocker.patch.object(
+        in_tree_actions.github,
+        "get_files_bulk",
+        AsyncMock(return_value={("org/app", "main"): b"main", ("org/app", "x"): b""}),
+    )
+
+    await in_tree_actions.prefetch_github_tcymls([project])
+
+    get_branches_bulk.assert_awaited_once_with(["org/app"])
+    get_files_bulk.assert_awaited_once_with(
+        [("org/app", "main"), ("org/app", "release-1")], ".taskcluster.yml"
+    )
+    assert await in_tree_actions.branches.get("org/app") == [
+        "dev",
+        "main",
+        "release-1",
+    ]
+    assert (
+        await in_tree_actions.tcyml.get(
+            project.repo, repo_type="git", default_branch="main"
+        )
+        == b"main"
+    )
+    # release-1 could not be fetched, so is left for tcyml.get to fetch over REST
+    assert len(in_tree_actions.tcyml._cache) == 1
@@ -2,9 +2,14 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file, You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
+import asyncio
 import hashlib
+from unittest.mock import AsyncMock, Mock, patch
 
 import pytest
+import pytest_asyncio
+from aiohttp import ClientResponseError, web
+from aiohttp.test_utils import TestServer
 from tcadmin.util.sessions import with_aiohttp_session
 
 from ciadmin.generate import tcyml
@@ -20,3 +25,118 @@ async def test_get_tcyml():
     res = await tcyml.get("https://hg.mozilla.org/mozilla-central", revision=PINNED_REV)
     await github.close_client()
     assert hashlib.sha512(res).hexdigest()[:10] == "684648599a"
+
+
+def node(rev):
+    "The full node that the fake hg server resolves `rev` to"
+    return hashlib.sha1(rev.encode()).hexdigest()
+
+
+@pytest_asyncio.fixture
+async def hg_server(monkeypatch):
+    """
+    A fake hg server, recording the number of requests for each path.  Every
+    revision other than "missing" exists, and the file at each contains its
+    revision name.
+    """
+    requests = {}
+    in_flight = [0, 0]  # current, maximum
+    revs = {}
+
+    async def count(request):
+        requests[request.path] = requests.get(request.path, 0) + 1
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        await asyncio.sleep(0.01)
+        in_flight[0] -= 1
+        if request.match_info["rev"] == "missing":
+            raise web.HTTPNotFound()
+
+    async def json_log(request):
+        await count(request)
+        assert request.query["revcount"] == "1"
+        rev = request.match_info["rev"]
+        revs[node(rev)] = rev
+        return web.json_response({"node": node(rev), "changesets": []})
+
+    async def raw_file(request):
+        await count(request)
+        rev = revs.get(request.match_info["rev"], request.match_info["rev"])
+        return web.Response(body=f"rev: {rev}".encode())
+
+    app = web.Application()
+    app.router.add_get("/{repo}/json-log/{rev}", json_log)
+    app.router.add_get("/{repo}/raw-file/{rev}/.taskcluster.yml", raw_file)
+    server = TestServer(app)
+    await server.start_server()
+    monkeypatch.setattr(tcyml, "_cache", {})
+    monkeypatch.setattr(tcyml, "_lock", {})
+    server.requests = requests
+    server.in_flight = in_flight
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+@with_aiohttp_session
+async def test_get_hg_shares_fetcher(hg_server, monkeypatch):
+    monkeypatch.setattr(tcyml, "HG_CONCURRENCY", 2)
+    repo = str(hg_server.make_url("/repo"))
+    results = await asyncio.gather(
+        *(tcyml.get(repo, default_branch=f"b{i}") for i in range(6))
+    )
+    assert results == [f"rev: b{i}".encode() for i in range(6)]
+    assert hg_server.in_flight[1] == 2
+    assert len(tcyml._hg_fetchers) == 1
+    # cached
+    assert await tcyml.get(repo, default_branch="b0") == b"rev: b0"
+    assert hg_server.requests["/repo/json-log/b0"] == 1
+
+
+@pytest.mark.asyncio
+@with_aiohttp_session
+async def test_get_hg_missing_ok(hg_server):
+    repo = str(hg_server.make_url("/repo"))
+    assert await tcyml.get(repo, default_branch="missing", missing_ok=True) is None
+    assert hg_server.requests["/repo/json-log/missing"] == 1
+    # a missing file is not cached
+    assert await tcyml.get(repo, default_branch="missing", missing_ok=True) is None
+    assert hg_server.requests["/repo/json-log/missing"] == 2
+
+
+@pytest.mark.asyncio
+@with_aiohttp_session
+async def test_get_hg_cached_by_node(hg_server, monkeypatch):
+    repo = str(hg_server.make_url("/repo"))
+    raw_file = f"/repo/raw-file/{node('default')}/.taskcluster.yml"
+    assert await tcyml.get(repo) == b"rev: default"
+    assert hg_server.requests == {"/repo/json-log/default": 1, raw_file: 1}
+
+    # a later run resolves the branch again, but reads the file from disk
+    monkeypatch.setattr(tcyml, "_cache", {})
+    assert await tcyml.get(repo) == b"rev: default"
+    assert hg_server.requests == {"/repo/json-log/default": 2, raw_file: 1}
+
+    # as does a lookup of the full node, without resolving it
+    assert await tcyml.get(repo, revision=node("default")) == b"rev: default"
+    assert hg_server.requests == {"/repo/json-log/default": 2, raw_file: 1}
+
+
+@pytest.mark.asyncio
+async def test_get_github_primed_missing(monkeypatch):
+    monkeypatch.setattr(tcyml, "_cache", {})
+    repo = "https://github.com/org/app"
+    tcyml.prime_github(repo, "main", None)
+    response = Mock(status=404)
+    response.raise_for_status.side_effect = ClientResponseError(
+        Mock(real_url=repo), (), status=404
+    )
+    client = AsyncMock()
+    client.request.return_value = response
+    with patch.object(github, "get_client", AsyncMock(return_value=client)):
+        assert await tcyml.get(repo, "git", "main", missing_ok=True) is None
+        client.request.assert_not_called()
+        # callers not expecting a missing file get the usual error from REST
+        with pytest.raises(ClientResponseError):
+            await tcyml.get(repo, "git", "main")
+        client.request.assert_awaited_once()
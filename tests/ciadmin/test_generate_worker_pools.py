@@ -2,21 +2,32 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file, You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
+import io
 from argparse import Namespace
 
+import attr
 import pytest
 from tcadmin.resources import Resources
 from tcadmin.resources.worker_pool import WorkerPool as TCWorkerPool
 
+from ciadmin.generate import worker_pools
 from ciadmin.generate.ciconfig.environment import Environment
 from ciadmin.generate.ciconfig.worker_images import WorkerImage, WorkerImages
 from ciadmin.generate.ciconfig.worker_pools import WorkerPool
 from ciadmin.generate.worker_pools import (
     _arm_deployment_resource_group,
+    _generator_digest,
+    _make_pool_configs,
+    _make_pool_configs_in_parallel,
+    _pool_fingerprint,
+    _shared_fingerprint,
     generate_pool_variants,
+    get_invalid_instances,
+    is_invalid_aws_instance_type,
     is_invalid_gcp_instance_type,
     make_worker_pool,
 )
+from ciadmin.util import cache
 from ciadmin.util.templates import merge
 
 
@@ -563,6 +574,86 @@ def test_is_invalid_gcp_instance_type(invalid_instances, zone, machine_type, exp
     )
 
 
+@pytest.mark.parametrize(
+    "zone,machine_type,expected",
+    [
+        # an unrestricted entry wins over a restricted one for the same family
+        ("us-west1-a", "c3d-standard-8", True),
+        ("us-west1-b", "c3d-standard-8", False),
+        ("us-west1-b", "c3d-highcpu-8", True),
+        ("us-west1-b", "c3d-standard-8-lssd", True),
+        ("us-west1-b", "c4d-highcpu-8-lssd", True),
+        ("us-west1-b", "c4d-highcpu-8", False),
+        ("us-central1-a", "c3d-highcpu-8-lssd", False),
+    ],
+)
+def test_invalid_instances_gcp_index(zone, machine_type, expected):
+    invalid_instances = [
+        {
+            "zones": ["us-west1-a", "us-west1-b"],
+            "families": ["c3d"],
+            "profiles": ["highcpu"],
+        },
+        {"zones": ["us-west1-a"], "families": ["c3d"]},
+        {
+            "zones": ["us-west1-a", "us-west1-b"],
+            "families": ["c3d", "c4d"],
+            "suffixes": ["lssd"],
+        },
+    ]
+    assert (
+        is_invalid_gcp_instance_type(invalid_instances, zone, machine_type) == expected
+    )
+
+
+@pytest.mark.parametrize(
+    "zone,instance_type,expected",
+    [
+        ("us-east-1e", "m5.large", True),
+        ("us-east-1e", "c5d.xlarge", True),
+        ("us-east-1b", "r3.large", True),
+        ("us-east-1b", "m5.large", False),
+        ("us-east-1a", "r3.large", False),
+    ],
+)
+def test_is_invalid_aws_instance_type(zone, instance_type, expected):
+    invalid_instances = [
+        {"zones": ["us-east-1e"], "families": ["m5", "c5d"]},
+        {"zones": ["us-east-1b", "us-east-1f"], "families": ["r3"]},
+    ]
+    assert (
+        is_invalid_aws_instance_type(invalid_instances, zone, instance_type) == expected
+    )
+
+
+def test_get_invalid_instances(environment):
+    environment = attr.evolve(
+        environment,
+        aws_config={
+            **environment.aws_config,
+            "invalid-instances": [{"zones": ["us-east-1e"], "families": ["m5"]}],
+        },
+    )
+    indexes = get_invalid_instances(environment)
+    assert indexes["aws"].is_invalid_aws("us-east-1e", "m5.large")
+    assert not indexes["aws"].is_invalid_aws("us-east-1a", "m5.large")
+    assert not indexes["google"].is_invalid_gcp("us-east-1e", "n2-standard-4")
+
+
+def test_make_pool_configs_builds_invalid_instances_once(
+    mocker, environment, make_pool, make_images
+):
+    "The invalid-instances indexes are built once per run, not once per pool"
+    spy = mocker.spy(worker_pools.InvalidInstances, "__init__")
+    pools = [
+        attr.evolve(make_pool(provider), pool_id=f"provId/{provider}-{i}")
+        for i in range(3)
+        for provider in ("aws", "google")
+    ]
+    _make_pool_configs(environment, pools, make_images(), {})
+    assert spy.call_count == 2
+
+
 @pytest.mark.parametrize(
     "pool_id,loc,per_region,expected",
     [
@@ -627,3 +718,112 @@ def test_variant_overrides_owner_and_email():
     a, b = generate_pool_variants([wp], "cluster")
     assert (a.owner, a.email_on_error) == ("default@example.com", True)
     assert (b.owner, b.email_on_error) == ("other@example.com", False)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("jobs", (2, 3, 10))
+async def test_make_pool_configs_in_parallel(environment, make_pool, make_images, jobs):
+    pools = []
+    for i in range(5):
+        for provider in ("aws", "google", "azure"):
+            pool = make_pool(provider, {"maxCapacity": i + 1})
+            pools.append(attr.evolve(pool, pool_id=f"provId/{provider}-{i}"))
+    images = make_images()
+
+    expected = _make_pool_configs(environment, pools, images, {})
+    result = await _make_pool_configs_in_parallel(environment, pools, images, {}, jobs)
+    assert result == expected
+    assert [c["maxCapacity"] for c in result] == [c["maxCapacity"] for c in expected]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("enabled", (True, False))
+async def test_make_pool_configs_in_parallel_cache_settings(
+    monkeypatch, cache_dir, environment, make_pool, make_images, enabled
+):
+    "Worker processes use the parent's cache directory and --no-cache setting"
+    monkeypatch.setattr(cache, "enabled", enabled)
+    pools = [attr.evolve(make_pool("aws"), pool_id=f"provId/aws-{i}") for i in range(2)]
+    await _make_pool_configs_in_parallel(environment, pools, make_images(), {}, 2)
+    entries = [p for p in cache_dir.rglob("*") if p.is_file()]
+    assert bool(entries) == enabled
+
+
+def test_make_pool_configs_cached(mocker, environment, make_pool, make_images):
+    pools = [make_pool("aws"), make_pool("google")]
+    images = make_images()
+    make_pool_config = mocker.spy(worker_pools, "_make_pool_config")
+
+    expected = _make_pool_configs(environment, pools, images, {})
+    assert make_pool_config.call_count == 2
+
+    # a second run is served entirely from the cache
+    assert _make_pool_configs(environment, pools, images, {}) == expected
+    assert make_pool_config.call_count == 2
+
+    # changing one pool only regenerates that pool
+    pools[1] = attr.evolve(pools[1], config={**pools[1].config, "maxCapacity": 20})
+    result = _make_pool_configs(environment, pools, images, {})
+    assert make_pool_config.call_count == 3
+    assert result[0] == expected[0]
+    assert result[1]["maxCapacity"] == 20
+
+    # changing the image, worker-defaults or environment regenerates the pools
+    # that use them
+    images = make_images({"aws": {"us-east1": "new-id"}})
+    _make_pool_configs(environment, pools, images, {})
+    assert make_pool_config.call_count == 5
+    _make_pool_configs(environment, pools, images, {"lifecycle": {}})
+    assert make_pool_config.call_count == 7
+    environment = attr.evolve(
+        environment,
+        aws_config={**environment.aws_config, "security-groups": ["other"]},
+    )
+    _make_pool_configs(environment, pools, images, {"lifecycle": {}})
+    assert make_pool_config.call_count == 9
+
+
+def test_pool_fingerprint_stable(environment, make_pool, make_images):
+    "Fingerprints depend on values, not on the identity of the input objects"
+    pool = make_pool("aws")
+    fingerprint = _pool_fingerprint(
+        _shared_fingerprint(environment, {}), pool, make_images()
+    )
+    assert fingerprint
+    assert fingerprint == _pool_fingerprint(
+        _shared_fingerprint(attr.evolve(environment), {}),
+        attr.evolve(pool),
+        make_images(),
+    )
+
+
+def test_generator_digest_covers_ciconfig(mocker):
+    "Changes to the ciconfig classes used in fingerprints invalidate the cache"
+    digest = _generator_digest()
+    _generator_digest.cache_clear()
+    real_open = open
+
+    def patched_open(path, *args, **kwargs):
+        f = real_open(path, *args, **kwargs)
+        if path.endswith("environment.py"):
+            return io.BytesIO(f.read() + b"# changed")
+        return f
+
+    mocker.patch("builtins.open", patched_open)
+    try:
+        assert _generator_digest() != digest
+    finally:
+        _generator_digest.cache_clear()
+
+
+def test_make_pool_configs_no_cache(
+    mocker, monkeypatch, environment, make_pool, make_images
+):
+    monkeypatch.setattr(cache, "enabled", False)
+    pools = [make_pool("aws")]
+    images = make_images()
+    make_pool_config = mocker.spy(worker_pools, "_make_pool_config")
+
+    _make_pool_configs(environment, pools, images, {})
+    _make_pool_configs(environment, pools, images, {})
+    assert make_pool_config.call_count == 2
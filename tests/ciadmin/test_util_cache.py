@@ -0,0 +1,49 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import collections
+
+from ciadmin.util import cache
+
+
+def test_store_and_load():
+    cache.store("test", "key", {"a": [1, 2]})
+    assert cache.load("test", "key") == {"a": [1, 2]}
+
+
+def test_load_missing():
+    assert cache.load("test", "missing") is None
+    assert cache.load("test", "missing", "default") == "default"
+
+
+def test_namespaces_are_distinct():
+    cache.store("one", "key", 1)
+    cache.store("two", "key", 2)
+    assert cache.load("one", "key") == 1
+    assert cache.load("two", "key") == 2
+
+
+def test_corrupt_entry_is_a_miss(cache_dir):
+    cache.store("test", "key", "value")
+    (entry,) = (p for p in cache_dir.rglob("*") if p.is_file())
+    entry.write_bytes(b"not a pickle")
+    assert cache.load("test", "key", "default") == "default"
+
+
+def test_disabled(monkeypatch):
+    cache.store("test", "key", "value")
+    monkeypatch.setattr(cache, "enabled", False)
+    assert cache.load("test", "key") is None
+    cache.store("test", "other", "value")
+    monkeypatch.setattr(cache, "enabled", True)
+    assert cache.load("test", "other") is None
+
+
+def test_stats(monkeypatch):
+    monkeypatch.setattr(cache, "stats", collections.Counter())
+    cache.store("test", "key", "value")
+    cache.load("test", "key")
+    cache.load("test", "key")
+    cache.load("test", "missing")
+    assert cache.stats == {("test", "hits"): 2, ("test", "misses"): 1}
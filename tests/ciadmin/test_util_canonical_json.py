@@ -0,0 +1,74 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import json
+
+import pytest
+
+from ciadmin.util.canonical_json import CanonicalJSON
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        None,
+        True,
+        False,
+        0,
+        -17,
+        2**70,
+        1.5,
+        1e100,
+        float("nan"),
+        float("inf"),
+        "",
+        "plain",
+        'quote " and \\ and \n',
+        "ünïcödé ☃ \U0001f600",
+        [],
+        {},
+        (1, 2),
+        [1, "two", [3.0, None], {"b": False, "a": True}],
+        {"z": {}, "a": [], "m": {"y": [{"k": "v"}], "x": 1}},
+        {"é": 1, "e": 2, "E": 3, "": 4},
+        {1: "int", 2: "keys"},
+        {"nested": {2: "int", 1.5: "float"}},
+    ],
+)
+def test_dumps_matches_json(value):
+    assert CanonicalJSON().dumps(value) == json.dumps(value, sort_keys=True)
+
+
+def test_dumps_shared_subtrees():
+    "Shared subtrees are serialized correctly wherever they appear"
+    shared = {"b": [1, 2, {"c": "d"}], "a": "x"}
+    encoder = CanonicalJSON()
+    for i in range(3):
+        value = {"i": i, "shared": shared, "again": [shared, shared["b"]]}
+        assert encoder.dumps(value) == json.dumps(value, sort_keys=True)
+
+
+def test_dumps_top_level_may_change():
+    "The top-level value is not remembered between calls"
+    encoder = CanonicalJSON()
+    value = {"a": 1}
+    assert encoder.dumps(value) == '{"a": 1}'
+    value["b"] = 2
+    assert encoder.dumps(value) == '{"a": 1, "b": 2}'
+
+
+def test_dumps_unserializable():
+    with pytest.raises(TypeError):
+        CanonicalJSON().dumps({"a": object()})
+
+
+def test_sha256():
+    value = {"workerConfig": {"x": [1, 2]}, "region": "us-east-1"}
+    assert (
+        CanonicalJSON().sha256("pool/id", value)
+        == hashlib.sha256(
+            ("pool/id" + json.dumps(value, sort_keys=True)).encode("utf8")
+        ).hexdigest()
+    )
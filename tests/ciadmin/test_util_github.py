@@ -0,0 +1,183 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from gql.transport.exceptions import TransportQueryError
+
+from ciadmin.util import github
+
+
+def refs(names, cursor=None):
+    return {
+        "refs": {
+            "pageInfo": {"hasNextPage": cursor is not None, "endCursor": cursor},
+            "nodes": [{"name": name} for name in names],
+        }
+    }
+
+
+@pytest.mark.asyncio
+async def test_get_branches_bulk():
+    client = AsyncMock()
+    client.execute.side_effect = [
+        {"r0": refs(["a", "b"], cursor="c1"), "r1": refs(["main"]), "r2": None},
+        {"r0": refs(["c"])},
+    ]
+    with patch.object(github, "get_client", AsyncMock(return_value=client)):
+        result = await github.get_branches_bulk(["org/one", "org/two", "org/gone"])
+
+    assert result == {"org/one": ["a", "b", "c"], "org/two": ["main"]}
+    first, second = (call.args[0] for call in client.execute.call_args_list)
+    assert 'repository(owner: "org", name: "one")' in first
+    assert "after: null" in first
+    assert 'repository(owner: "org", name: "one")' in second
+    assert 'after: "c1"' in second
+    assert "org/two" not in second
+
+
+@pytest.mark.asyncio
+async def test_get_branches_bulk_query_failure(capsys):
+    client = AsyncMock()
+    client.execute.side_effect = Exception("rate limited")
+    with patch.object(github, "get_client", AsyncMock(return_value=client)):
+        assert await github.get_branches_bulk(["org/one"]) == {}
+    assert "Falling back to REST" in capsys.readouterr().err
+
+
+def blob_sha(content):
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+@pytest.mark.asyncio
+async def test_get_files_bulk(mocker):
+    mocker.patch.object(github, "GRAPHQL_BATCH_SIZE", 3)
+    tasks = b"tasks: []\n"
+    other = b"tasks: [other]\n"
+    client = AsyncMock()
+    client.execute.side_effect = [
+        # blob ids, in batches of 3
+        {
+            "f0": {"object": {"oid": blob_sha(tasks)}},
+            "f1": {"object": None},
+            "f2": {"object": {"oid": blob_sha(tasks)}},
+        },
+        {
+            "f3": {"object": {"oid": blob_sha(other)}},
+            "f4": None,
+            "f5": {"object": {"oid": "truncated"}},
+        },
+        # each distinct blob's content
+        {
+            "b0": {"object": {"text": tasks.decode(), "isBinary": False}},
+            "b1": {"object": {"text": other.decode()}},
+            "b2": {"object": {"text": "trunc", "isTruncated": True}},
+        },
+    ]
+    requests = [
+        ("org/a", "main"),
+        ("org/a", "old"),
+        ("org/fork", "main"),
+        ("org/b", "main"),
+        ("org/gone", "main"),
+        ("org/c", "main"),
+    ]
+    with patch.object(github, "get_client", AsyncMock(return_value=client)):
+        result = await github.get_files_bulk(requests, ".taskcluster.yml")
+
+    assert result == {
+        ("org/a", "main"): tasks,
+        ("org/a", "old"): None,
+        ("org/fork", "main"): tasks,
+        ("org/b", "main"): other,
+    }
+    assert result["org/a", "main"] is result["org/fork", "main"]
+    queries = [call.args[0] for call in client.execute.call_args_list]
+    assert 'object(expression: "old:.taskcluster.yml")' in queries[0]
+    assert f'object(oid: "{blob_sha(tasks)}")' in queries[2]
+
+    # blobs are kept in the store, so only their ids are fetched again
+    client.execute.reset_mock()
+    client.execute.side_effect = [
+        {"f0": {"object": {"oid": blob_sha(tasks)}}},
+    ]
+    with patch.object(github, "get_client", AsyncMock(return_value=client)):
+        result = await github.get_files_bulk([("org/a", "main")], ".taskcluster.yml")
+    assert result == {("org/a", "main"): tasks}
+    assert client.execute.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_get_files_bulk_mismatched_text():
+    "Text that does not reproduce the blob's bytes is not used"
+    content = b"caf\xe9\n"
+    client = AsyncMock()
+    client.execute.side_effect = [
+        {"f0": {"object": {"oid": blob_sha(content)}}},
+        {"b0": {"object": {"text": "caf\ufffd\n"}}},
+    ]
+    with patch.object(github, "get_client", AsyncMock(return_value=client)):
+        result = await github.get_files_bulk([("org/a", "main")], ".taskcluster.yml")
+    assert result == {}
+
+
+@pytest.mark.asyncio
+async def test_get_blob_oids_bulk_not_a_blob():
+    "Missing paths are None, and paths that are not files are left for REST"
+    client = AsyncMock()
+    client.execute.side_effect = [
+        {
+            "f0": {"object": {"oid": "abc"}},
+            "f1": {"object": None},
+            # a directory: the `... on Blob` fragment selects nothing
+            "f2": {"object": {}},
+        },
+    ]
+    requests = [("org/a", "main"), ("org/a", "gone"), ("org/a", "dir")]
+    with patch.object(github, "get_client", AsyncMock(return_value=client)):
+        result = await github.get_blob_oids_bulk(requests, ".taskcluster.yml")
+    assert result == {("org/a", "main"): "abc", ("org/a", "gone"): None}
+
+
+@pytest.mark.asyncio
+async def test_get_files_bulk_query_failure(capsys):
+    client = AsyncMock()
+    client.execute.side_effect = Exception("rate limited")
+    with patch.object(github, "get_client", AsyncMock(return_value=client)):
+        result = await github.get_files_bulk([("org/a", "main")], ".taskcluster.yml")
+    assert result == {}
+    captured = capsys.readouterr()
+    assert "Falling back to REST for 1 copies of .taskcluster.yml" in captured.err
+    assert captured.out == ""
+
+
+def not_found(alias, data):
+    "The error raised when GitHub cannot resolve one aliased repository"
+    error = {"type": "NOT_FOUND", "path": [alias]}
+    return TransportQueryError(str(error), errors=[error], data=data)
+
+
+@pytest.mark.asyncio
+async def test_get_blob_oids_bulk_partial_failure(capsys):
+    "One unresolvable repository does not send the rest of its batch to REST"
+    client = AsyncMock()
+    client.execute.side_effect = not_found(
+        "f1", {"f0": {"object": {"oid": "abc"}}, "f1": None, "f2": {"object": {}}}
+    )
+    requests = [("org/a", "main"), ("org/gone", "main"), ("org/b", "dir")]
+    with patch.object(github, "get_client", AsyncMock(return_value=client)):
+        result = await github.get_blob_oids_bulk(requests, ".taskcluster.yml")
+    assert result == {("org/a", "main"): "abc"}
+    assert "Falling back to REST for some" in capsys.readouterr().err
+
+
+@pytest.mark.asyncio
+async def test_get_branches_bulk_partial_failure():
+    client = AsyncMock()
+    client.execute.side_effect = not_found("r1", {"r0": refs(["main"]), "r1": None})
+    with patch.object(github, "get_client", AsyncMock(return_value=client)):
+        result = await github.get_branches_bulk(["org/one", "org/gone"])
+    assert result == {"org/one": ["main"]}
@@ -0,0 +1,159 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import pytest
+
+from ciadmin.util.keyed_by import (
+    KeyedBy,
+    KeyedByCache,
+    compile_keyed_by,
+    evaluate_keyed_by,
+)
+
+NESTED = {
+    "by-region": {
+        "us-.*": {
+            "by-zone": {
+                "us-east-1a": "east-a",
+                "default": "east",
+            }
+        },
+        "eu-west-1": "eu",
+        "default": "elsewhere",
+    }
+}
+
+
+@pytest.mark.parametrize(
+    "value, attributes, expected",
+    (
+        ("literal", {}, "literal"),
+        (None, {"region": "us-east-1"}, None),
+        ({"a": 1, "b": 2}, {}, {"a": 1, "b": 2}),
+        (NESTED, {"region": "eu-west-1"}, "eu"),
+        (NESTED, {"region": "us-east-1", "zone": "us-east-1a"}, "east-a"),
+        (NESTED, {"region": "us-east-1", "zone": "us-east-1b"}, "east"),
+        (NESTED, {"region": "us-east-1"}, "east"),
+        (NESTED, {"region": "ap-south-1"}, "elsewhere"),
+        (NESTED, {}, "elsewhere"),
+        ({"by-level": {"1": "one", "3": "three"}}, {"level": "3"}, "three"),
+        ({"by-level": {1: "one", 3: "three"}}, {"level": 3}, "three"),
+    ),
+)
+def test_compiled_matches_evaluate(value, attributes, expected):
+    assert evaluate_keyed_by(value, "item", attributes) == expected
+    assert compile_keyed_by(value).evaluate("item", attributes) == expected
+
+
+def test_compiled_returns_same_object():
+    value = {"by-region": {"default": [1], "x": [2]}}
+    assert compile_keyed_by(value).evaluate("item", {}) is value["by-region"]["default"]
+
+
+@pytest.mark.parametrize(
+    "value, attributes",
+    (
+        # only default
+        ({"by-region": {"default": 1}}, {"region": "x"}),
+        # no attribute, no default
+        ({"by-region": {"a": 1}}, {}),
+        # multiple matches
+        ({"by-region": {"a.*": 1, ".*b": 2}}, {"region": "ab"}),
+        # no match, no default
+        ({"by-region": {"a": 1}}, {"region": "b"}),
+        # nested error
+        ({"by-region": {"a": {"by-zone": {"z": 1}}}}, {"region": "a", "zone": "y"}),
+    ),
+)
+def test_compiled_errors_match_evaluate(value, attributes):
+    with pytest.raises(Exception) as expected:
+        evaluate_keyed_by(value, "item", attributes)
+    with pytest.raises(Exception) as actual:
+        compile_keyed_by(value).evaluate("item", attributes)
+    assert str(actual.value) == str(expected.value)
+    assert type(actual.value) is type(expected.value)
+
+
+def test_compiled_reusable():
+    compiled = compile_keyed_by(NESTED)
+    for region, zone, expected in (
+        ("eu-west-1", None, "eu"),
+        ("us-east-1", "us-east-1a", "east-a"),
+        ("us-west-2", "us-west-2a", "east"),
+        ("sa-east-1", None, "elsewhere"),
+    ):
+        attributes = {"region": region, "zone": zone}
+        assert compiled.evaluate("item", attributes) == expected
+
+
+def test_compiled_invalid_regex_deferred():
+    # an invalid pattern only errors when it needs to be used, as before
+    value = {"by-region": {"a": 1, "[": 2}}
+    compiled = compile_keyed_by(value)
+    assert compiled.evaluate("item", {"region": "a"}) == 1
+    with pytest.raises(Exception) as expected:
+        evaluate_keyed_by(value, "item", {"region": "b"})
+    with pytest.raises(Exception) as actual:
+        compiled.evaluate("item", {"region": "b"})
+    assert str(actual.value) == str(expected.value)
+
+
+def test_compiled_fields():
+    assert compile_keyed_by("literal").fields == ()
+    assert compile_keyed_by(NESTED).fields == ("region", "zone")
+
+
+def test_cache_matches_evaluate():
+    cache = KeyedByCache()
+    for attributes in (
+        {"region": "eu-west-1"},
+        {"region": "us-east-1", "zone": "us-east-1a"},
+        {"region": "us-east-1", "zone": "us-east-1b"},
+        {"region": "us-east-1", "zone": "us-east-1a", "pool": "other"},
+        {"region": "ap-south-1"},
+    ):
+        expected = evaluate_keyed_by(NESTED, "item", attributes)
+        assert cache.evaluate(NESTED, "item", attributes) == expected
+
+
+def test_cache_keys_on_relevant_attributes(mocker):
+    cache = KeyedByCache()
+    value = {"by-region": {"us-.*": ["a", "b"], "default": ["c"]}}
+    evaluate = mocker.spy(KeyedBy, "evaluate")
+
+    first = cache.evaluate(value, "pool-1", {"region": "us-east-1", "pool": "1"})
+    second = cache.evaluate(value, "pool-2", {"region": "us-east-1", "pool": "2"})
+    assert first is second is value["by-region"]["us-.*"]
+    assert evaluate.call_count == 1
+
+    assert cache.evaluate(value, "pool-3", {"region": "eu-west-1"}) == ["c"]
+    assert evaluate.call_count == 2
+
+
+def test_cache_distinguishes_types():
+    cache = KeyedByCache()
+    value = {"by-level": {1: "one", "1": "string-one", "default": "other"}}
+    assert cache.evaluate(value, "item", {"level": 1}) == "one"
+    assert cache.evaluate(value, "item", {"level": "1"}) == "string-one"
+
+
+def test_cache_errors_name_each_item():
+    cache = KeyedByCache()
+    value = {"by-region": {"a": 1}}
+    for item_name in ("first", "second"):
+        with pytest.raises(Exception, match=f"determining item {item_name}"):
+            cache.evaluate(value, item_name, {"region": "b"})
+
+
+def test_cache_literal_and_unhashable():
+    cache = KeyedByCache()
+    literal = {"a": 1}
+    assert cache.evaluate(literal, "item", {}) is literal
+    # unhashable attributes are evaluated (and fail) just as they would be
+    # without the cache
+    value = {"by-region": {"default": 1, "x": 2}}
+    with pytest.raises(TypeError):
+        evaluate_keyed_by(value, "item", {"region": ["x"]})
+    with pytest.raises(TypeError):
+        cache.evaluate(value, "item", {"region": ["x"]})
@@ -1,6 +1,17 @@
+import pathlib
+
 import pytest
 
-from ciadmin.util.matching import glob_match
+from ciadmin.generate.ciconfig.projects import Project
+from ciadmin.util import yml
+from ciadmin.util.matching import (
+    ProjectGrantee,
+    ProjectIndex,
+    glob_match,
+    project_match,
+)
+
+ROOT = pathlib.Path(__file__).parents[2]
 
 
 @pytest.mark.parametrize(
@@ -64,3 +75,38 @@ from ciadmin.util.matching import glob_match
 )
 def test_glob_match(grantee_values, proj_value, expected_result):
     assert glob_match(grantee_values, proj_value) == expected_result
+
+
+@pytest.fixture(scope="module")
+def all_projects():
+    projects = yml.safe_load((ROOT / "projects.yml").read_bytes())
+    return [Project(alias, **info) for alias, info in projects.items()]
+
+
+@pytest.mark.parametrize(
+    "grantee",
+    [
+        ProjectGrantee(),
+        ProjectGrantee(access="scm_level_3"),
+        ProjectGrantee(access=["scm_level_1", "scm_level_2"]),
+        ProjectGrantee(level=3),
+        ProjectGrantee(level=[1, 2]),
+        ProjectGrantee(level=3, repo_type="git"),
+        ProjectGrantee(alias=["mozilla-central", "try", "no-such-project"]),
+        ProjectGrantee(repo_type="hg", trust_domain="gecko"),
+        ProjectGrantee(trust_domain=["comm", "mobile"], level=[1]),
+        ProjectGrantee(is_try=True),
+        ProjectGrantee(is_try=False, access="scm_level_1"),
+        ProjectGrantee(has_trust_project=True),
+        ProjectGrantee(has_trust_project=False, repo_type="git"),
+        ProjectGrantee(feature="taskgraph-actions"),
+        ProjectGrantee(feature=["gecko-roles", "!is-trunk"]),
+        ProjectGrantee(feature="!taskgraph-cron", level=3),
+        ProjectGrantee(feature="no-such-feature"),
+        ProjectGrantee(access=[]),
+    ],
+)
+def test_project_index_matches_project_match(all_projects, grantee):
+    index = ProjectIndex(all_projects)
+    expected = [p for p in all_projects if project_match(grantee, p)]
+    assert index.matching(grantee) == expected
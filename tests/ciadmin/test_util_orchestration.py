@@ -0,0 +1,185 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+import threading
+
+import pytest
+from tcadmin import generate, options
+from tcadmin.appconfig import AppConfig
+from tcadmin.resources import Resources, Role
+from tcadmin.util.matchlist import Match, MatchList
+
+from ciadmin.util import orchestration
+from ciadmin.util.orchestration import GeneratorRegistry, run_cpu_bound
+
+
+@pytest.fixture(autouse=True)
+def appconfig():
+    "Roles need a current AppConfig for their description prefix"
+    appconfig = AppConfig()
+    with AppConfig._as_current(appconfig):
+        yield appconfig
+
+
+def make_generator(name, delay, roles):
+    async def generator(resources):
+        resources.manage(f"Role={name}:.*")
+        await asyncio.sleep(delay)
+        for roleId, description in roles:
+            resources.add(Role(roleId=roleId, description=description, scopes=[]))
+
+    generator.__name__ = name
+    return generator
+
+
+def registry(*generators):
+    rv = GeneratorRegistry("generators")
+    for generator in generators:
+        rv.register(generator)
+    return rv
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("delays", [(0, 0.02), (0.02, 0)])
+async def test_merged_in_registration_order(delays):
+    "Resources are merged in registration order, whichever finishes first"
+    generators = registry(
+        make_generator("first", delays[0], [("first:shared", "from first")]),
+        make_generator("second", delays[1], [("first:shared", "from second")]),
+    )
+    resources = Resources()
+    await generators._call_all(resources)
+    (role,) = resources
+    assert role.description.endswith("from first")
+    assert [entry.include for entry in resources.managed] == [
+        "Role=first:.*",
+        "Role=second:.*",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_runs_concurrently():
+    started = []
+    release = asyncio.Event()
+
+    async def waits(resources):
+        started.append("waits")
+        await release.wait()
+
+    async def releases(resources):
+        started.append("releases")
+        release.set()
+
+    await registry(waits, releases)._call_all(Resources())
+    assert started == ["waits", "releases"]
+
+
+@pytest.mark.asyncio
+async def test_unmanaged():
+    async def generator(resources):
+        resources.add(Role(roleId="unmanaged", description="", scopes=[]))
+
+    with pytest.raises(RuntimeError, match="unmanaged resource: Role=unmanaged"):
+        await registry(generator)._call_all(Resources())
+
+
+@pytest.mark.asyncio
+async def test_managed_with_excludes():
+    generators = registry(
+        make_generator("a", 0, [("a:kept", "")]),
+        make_generator("b", 0, [("b:x", "")]),
+    )
+    resources = Resources()
+    resources.manage("Role=c:.*", excludes=["Role=c:excluded"])
+    await generators._call_all(resources)
+    assert [role.roleId for role in resources] == ["a:kept", "b:x"]
+    assert resources.is_managed("Role=c:included")
+    assert not resources.is_managed("Role=c:excluded")
+    assert not resources.is_managed("Role=d:other")
+
+
+def test_filter():
+    a = make_generator("a", 0, [])
+    b = make_generator("b", 0, [])
+    filtered = registry(a, b).filter(["b"])
+    assert isinstance(filtered, GeneratorRegistry)
+    assert list(filtered) == [b]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("offload", [True, False])
+async def test_run_cpu_bound(monkeypatch, offload):
+    monkeypatch.setattr(orchestration, "offload_cpu", offload)
+    thread = await run_cpu_bound(lambda x: (x, threading.current_thread()), 1)
+    assert thread[0] == 1
+    assert (thread[1] is threading.current_thread()) is not offload
+
+
+def test_match_list_compiles_per_instance():
+    patterns = [Match("Role=a:.*", ("Role=a:x",)), Match("Role=b$")]
+    first = orchestration._MatchList(patterns)
+    second = orchestration._MatchList(patterns)
+    for item in ("Role=a:y", "Role=a:x", "Role=b", "Role=bc", "Role=c"):
+        assert first.matches(item) == MatchList(patterns).matches(item)
+    assert set(first._compiled) == {"Role=a:.*", "Role=a:x", "Role=b$"}
+    assert second._compiled == {}
+
+
+# The tests below check the tc-admin internals listed at the top of
+# ciadmin.util.orchestration, so that an upgrade which changes them fails here
+# rather than silently changing the generated resources.
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("only", [None, "gen"])
+async def test_tcadmin_generate_calls_registry(appconfig, only):
+    "tc-admin's generate runs the (filtered) registry's _call_all"
+    seen = []
+
+    async def gen(resources):
+        seen.append(type(resources))
+        resources.manage("Role=gen:.*")
+        resources.add(Role(roleId="gen:role", description="", scopes=[]))
+
+    appconfig.generators = registry(gen)
+    with options.test_options(generated=None, only=only):
+        resources = await generate.resources()
+    assert seen == [orchestration._GeneratedResources]
+    assert [role.roleId for role in resources] == ["gen:role"]
+
+
+def test_tcadmin_resources_verify(mocker):
+    "Resources.add and update check is_managed, then call _verify"
+    role = Role(roleId="a", description="", scopes=[])
+    resources = Resources()
+    for add in (resources.add, lambda r: resources.update([r])):
+        with pytest.raises(RuntimeError, match="unmanaged resource: Role=a"):
+            add(role)
+
+    generated = orchestration._GeneratedResources()
+    generated.add(role)
+    assert list(generated) == [role]
+
+    resources.manage("Role=.*")
+    verify = mocker.patch.object(Resources, "_verify")
+    resources.update([role, Role(roleId="b", description="", scopes=[])])
+    verify.assert_called_once_with()
+    resources.add(Role(roleId="c", description="", scopes=[]))
+    assert verify.call_count == 2
+
+
+def test_tcadmin_match_list_entries():
+    "Iterating a MatchList gives its Match entries, which rebuild an equal list"
+    managed = MatchList([])
+    managed.add("Role=a:.*", excludes=["Role=a:x"])
+    managed.add("Role=b")
+    entries = list(managed)
+    assert entries == [Match("Role=a:.*", ("Role=a:x",)), Match("Role=b", ())]
+    assert [(entry.include, entry.excludes) for entry in entries] == [
+        ("Role=a:.*", ("Role=a:x",)),
+        ("Role=b", ()),
+    ]
+    rebuilt = orchestration._MatchList(entries)
+    assert rebuilt.to_json() == managed.to_json()
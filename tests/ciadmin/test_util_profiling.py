@@ -0,0 +1,77 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+import json
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from ciadmin.util import cache
+from ciadmin.util.profiling import Profiler
+
+
+@pytest.fixture(autouse=True)
+def restore_aiohttp(monkeypatch):
+    "Undo the profiler's wrapping of aiohttp after each test"
+    monkeypatch.setattr(
+        aiohttp.ClientSession, "_request", aiohttp.ClientSession._request
+    )
+
+
+@pytest.mark.asyncio
+async def test_profiler(tmp_path):
+    async def ok(request):
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_get("/", ok)
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+
+    running = []
+
+    async def fetch(resources):
+        running.append("fetch")
+        await asyncio.sleep(0.01)
+        assert running == ["fetch"], "profiled generators run one at a time"
+        async with aiohttp.ClientSession() as session:
+            for _ in range(3):
+                async with session.get(server.make_url("/")) as response:
+                    assert await response.text() == "ok"
+        running.remove("fetch")
+
+    async def load(resources):
+        running.append("load")
+        cache.store("test", "present", 1)
+        for key in ("present", "present", "present", "missing"):
+            cache.load("test", key)
+        running.remove("load")
+
+    path = tmp_path / "profile.json"
+    profiler = Profiler(str(path), cprofile=True)
+    fetch = profiler.wrap("fetch", fetch)
+    load = profiler.wrap("load", load)
+    assert fetch.__name__ == "fetch"
+
+    try:
+        await asyncio.gather(fetch(None), load(None))
+    finally:
+        await server.close()
+
+    report = json.loads(path.read_text())
+    assert set(report) == {"fetch", "load"}
+    assert report["fetch"]["http_requests"] == {"127.0.0.1": 3}
+    assert report["fetch"]["cache"] == {}
+    assert report["load"]["http_requests"] == {}
+    assert report["load"]["cache"] == {
+        "test": {"hits": 3, "misses": 1, "hit_rate": 0.75}
+    }
+    for name in ("fetch", "load"):
+        assert report[name]["wall_time"] >= 0
+        assert report[name]["cpu_time"] >= 0
+        assert report[name]["max_rss"] > 0
+        assert (tmp_path / f"profile.{name}.prof").exists()
@@ -0,0 +1,56 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import itertools
+import random
+
+import pytest
+from tcadmin.util.scopes import normalizeScopes
+
+from ciadmin.util.scopes import ScopeSet
+
+
+@pytest.mark.parametrize(
+    "scopes",
+    [
+        [],
+        ["a"],
+        ["a", "a", "b"],
+        ["a:b", "a:*"],
+        ["a:*", "a:b:*", "a:b:c", "a:"],
+        ["*", "anything", "at:all"],
+        ["queue:create-task:highest:proj-gecko/*", "queue:create-task:*", "queue"],
+        ["assume:repo:github.com/mozilla-mobile/*", "assume:repo:github.com/*"],
+        # a star scope satisfied by a longer star scope
+        ["a*", "a**"],
+        ["a*", "a**", "a***", "ab", "b"],
+    ],
+)
+def test_normalized_matches_normalizeScopes(scopes):
+    expected = normalizeScopes(scopes)
+    for ordering in itertools.permutations(scopes):
+        assert ScopeSet(ordering).normalized() == expected
+
+
+def test_normalized_matches_normalizeScopes_random():
+    rng = random.Random(42)
+    alphabet = ["a", "b", ":", "*"]
+    for _ in range(500):
+        scopes = [
+            "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 5)))
+            for _ in range(rng.randint(0, 20))
+        ]
+        assert ScopeSet(scopes).normalized() == normalizeScopes(scopes)
+
+
+def test_incremental():
+    scopes = ScopeSet()
+    scopes.add("repo:b")
+    scopes.add("repo:a")
+    assert list(scopes) == ["repo:a", "repo:b"]
+    scopes.add("repo:*")
+    assert list(scopes) == ["repo:*"]
+    scopes.update(["repo:c", "other"])
+    assert len(scopes) == 2
+    assert scopes.normalized() == ["other", "repo:*"]
@@ -4,7 +4,7 @@
 
 import pytest
 
-from ciadmin.util.templates import deep_get, merge, merge_to
+from ciadmin.util.templates import deep_get, merge, merge_shared, merge_to
 
 print(__file__)
 
@@ -55,6 +55,39 @@ def test_merge():
     assert third == {"c": 300, "d": 400}
 
 
+@pytest.mark.parametrize(
+    "objects",
+    (
+        pytest.param(({"a": 1},), id="single"),
+        pytest.param(({"a": 1, "b": 2, "d": 11}, {"b": 20, "c": 30}), id="scalars"),
+        pytest.param(
+            ({"x": {"y": [1], "z": 1}}, {"x": {"y": [2]}}, {"x": {"w": 3}}),
+            id="nested",
+        ),
+        pytest.param(({"x": [1, 2]}, {"x": "abc"}, {"x": {"y": 1}}), id="types"),
+        pytest.param(({"x": None}, {"x": None, "y": None}), id="none"),
+    ),
+)
+def test_merge_shared_matches_merge(objects):
+    assert merge_shared(*objects) == merge(*objects)
+
+
+def test_merge_shared_shares_unchanged_subtrees():
+    base = {"big": {"deep": {"tree": [1, 2, 3]}}, "small": {"a": 1}}
+    override = {"small": {"b": 2}}
+    result = merge_shared(base, override)
+    assert result == {"big": {"deep": {"tree": [1, 2, 3]}}, "small": {"a": 1, "b": 2}}
+
+    # untouched subtrees are shared, changed paths are copied
+    assert result["big"] is base["big"]
+    assert result["small"] is not base["small"]
+    assert result is not base
+
+    # inputs haven't changed..
+    assert base == {"big": {"deep": {"tree": [1, 2, 3]}}, "small": {"a": 1}}
+    assert override == {"small": {"b": 2}}
+
+
 @pytest.mark.parametrize(
     "args,expected",
     (
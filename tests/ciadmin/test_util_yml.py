@@ -0,0 +1,86 @@
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import pathlib
+
+import pytest
+import yaml
+
+from ciadmin.util import yml
+
+ROOT = pathlib.Path(__file__).parents[2]
+
+# Every YAML file in the repository: top-level config, grants.d, hook templates,
+# the in-tree taskgraph config and build-decision's schemas.
+CONFIG_FILES = sorted(
+    {
+        str(p.relative_to(ROOT))
+        for pattern in (
+            "*.yml",
+            "grants.d/*.yml",
+            "hook-templates/**/*.yml",
+            "taskcluster/**/*.yml",
+            "build-decision/src/**/*.yml",
+        )
+        for p in ROOT.glob(pattern)
+    }
+)
+
+requires_libyaml = pytest.mark.skipif(
+    not yaml.__with_libyaml__, reason="PyYAML was built without libyaml"
+)
+
+
+def shape(value, seen=None):
+    """
+    Return a representation of `value` that also records which containers are
+    shared (i.e. were produced by a YAML alias), by replacing repeat visits
+    with the index of their first occurrence.
+    """
+    if seen is None:
+        seen = {}
+    if isinstance(value, dict | list):
+        if id(value) in seen:
+            return ("alias", seen[id(value)])
+        seen[id(value)] = len(seen)
+        if isinstance(value, dict):
+            return {k: shape(v, seen) for k, v in value.items()}
+        return [shape(v, seen) for v in value]
+    return (type(value).__name__, value)
+
+
+def test_config_files_found():
+    assert "worker-pools.yml" in CONFIG_FILES
+    assert ".taskcluster.yml" in CONFIG_FILES
+    assert any(f.startswith("grants.d/") for f in CONFIG_FILES)
+
+
+@requires_libyaml
+def test_uses_libyaml():
+    assert yml.Loader is yaml.CSafeLoader
+
+
+@requires_libyaml
+@pytest.mark.parametrize("filename", CONFIG_FILES)
+def test_loader_parity(filename):
+    data = (ROOT / filename).read_bytes()
+    expected = yaml.load(data, Loader=yaml.SafeLoader)
+    actual = yaml.load(data, Loader=yaml.CSafeLoader)
+    assert actual == expected
+    assert shape(actual) == shape(expected)
+
+
+def test_aliases_are_shared():
+    result = yml.safe_load("a: &x {b: 1}\nc: *x\n")
+    assert result == {"a": {"b": 1}, "c": {"b": 1}}
+    assert result["a"] is result["c"]
+
+
+def test_accepts_bytes_and_str():
+    assert yml.safe_load(b"a: 1") == yml.safe_load("a: 1") == {"a": 1}
+
+
+def test_fallback_loader(monkeypatch):
+    monkeypatch.setattr(yml, "Loader", yaml.SafeLoader)
+    assert yml.safe_load("a: [1, 2]") == {"a": [1, 2]}